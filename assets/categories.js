@@ -0,0 +1,63 @@
+// Clientside callbacks for the category dropdowns. The category tables are sent to the browser once
+// in the 'category-tables' store, and the custom groups of the user are in the user stores.
+// The functions give the same options as the getters of DataParser
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    categories: {
+
+        // Default categories updated with the custom groups, as in DataParser.get_pos_categories
+        // and the others. Custom groups with the name of a default category replace it
+        merge: function(defaults, custom) {
+            return Object.assign({}, defaults, custom);
+        },
+
+        // Tags of the selected POS-tag groups and their options, with the name of the tag and its
+        // ditto tags shown on hover
+        pos_options_with_hover: function(mains, custom, tables) {
+            const categories = window.dash_clientside.categories.merge(tables.pos_categories, custom);
+            const values = [];
+            const options = [];
+            (mains || []).forEach(function(main) {
+                (categories[main] || []).forEach(function(tag) {
+                    const label = tables.pos_labels[tag] || tag;
+                    const dittos = tables.pos_dittos[tag] || [tag];
+                    values.push(tag);
+                    options.push({'label': tag, 'value': tag, 'title': label + '\n' + dittos.join(', ')});
+                });
+            });
+            return [values, options];
+        },
+
+        // Tags of the selected POS-tag groups and their options
+        pos_options: function(mains, custom, tables) {
+            const categories = window.dash_clientside.categories.merge(tables.pos_categories, custom);
+            const values = [];
+            (mains || []).forEach(function(main) {
+                values.push.apply(values, categories[main] || []);
+            });
+            const options = values.map(function(tag) {
+                return {'label': tag, 'value': tag};
+            });
+            return [values, options];
+        },
+
+        // Groups of the selected rank or relationship grouping and their options, with the codes
+        // of the group shown on hover. table is the name of the default categories in tables
+        group_options: function(main, custom, tables, table) {
+            const categories = window.dash_clientside.categories.merge(tables[table], custom);
+            const groups = categories[main] || {};
+            const values = Object.keys(groups);
+            const options = values.map(function(group) {
+                return {'label': group, 'value': group, 'title': groups[group].join(', ')};
+            });
+            return [values, options];
+        },
+
+        rank_options: function(main, custom, tables) {
+            return window.dash_clientside.categories.group_options(main, custom, tables, 'rank_categories');
+        },
+
+        relationship_options: function(main, custom, tables) {
+            return window.dash_clientside.categories.group_options(main, custom, tables, 'relationship_categories');
+        }
+    }
+});
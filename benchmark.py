@@ -0,0 +1,928 @@
+# Measurements and consistency checks for the data pipeline.
+# Run from the project root with the TCEECE folder in place, e.g. `python benchmark.py parsers`
+import argparse
+import copy
+import io
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+import types
+
+import numpy as np
+import pandas as pd
+from lxml import etree
+from nltk.tokenize import RegexpTokenizer
+from nltk.stem.wordnet import WordNetLemmatizer
+from gensim.corpora import Dictionary
+from data_parser import DataParser
+from line_counts import LineCounts
+from result_store import ResultStore
+from model_cache import ModelCache
+from pos_categories import pos_categories
+from attribute_categories import rank_categories, relationship_categories
+
+# Corpus in the format the app used before the Parquet cache
+path_to_csv = 'TCEECE/data.csv'
+
+
+# Compares the streaming lxml parser against the BeautifulSoup parser on a random sample of letters
+def check_parsers(sample, seed):
+    parser = DataParser.__new__(DataParser)
+    files = parser.get_letter_files()
+    if sample and sample < len(files):
+        files = sorted(random.Random(seed).sample(files, sample))
+
+    stream_time = 0.0
+    soup_time = 0.0
+    mismatches = []
+    fallbacks = []
+
+    for path in files:
+        start = time.perf_counter()
+        expected = parser.read_items_soup(path)
+        soup_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        try:
+            result = parser.read_items_stream(path)
+        except (etree.XMLSyntaxError, ValueError):
+            # These files are read with BeautifulSoup in the app as well
+            fallbacks.append(path)
+            continue
+        stream_time += time.perf_counter() - start
+
+        if result != expected:
+            mismatches.append(path)
+
+    print('Compared {} letters: {} identical, {} different, {} fall back to BeautifulSoup'.format(
+        len(files), len(files) - len(mismatches) - len(fallbacks), len(mismatches), len(fallbacks)))
+    print('BeautifulSoup {:.2f} s, streaming lxml {:.2f} s'.format(soup_time, stream_time))
+    for path in mismatches:
+        print('Different output: {}'.format(path))
+
+    return mismatches
+
+
+# Loads the corpus in the given format and prints the load time and the peak resident memory.
+# 'arrays' only opens the memory-mapped token arrays and the letter table, as the app does on startup
+def load_corpus(fmt, columns):
+    start = time.perf_counter()
+    if fmt == 'csv':
+        df = pd.read_csv(path_to_csv, index_col=False, usecols=columns)
+        df = df.dropna(axis='index')
+        data_mb = df.memory_usage(deep=True).sum() / 1024**2
+    else:
+        parser = DataParser.__new__(DataParser)
+        parser.load_corpus()
+        if fmt == 'parquet':
+            df = parser.corpus_view(columns)
+            data_mb = df.memory_usage(deep=True).sum() / 1024**2
+        else:
+            data_mb = sum(getattr(parser, name).nbytes for name in parser.array_names) / 1024**2
+    seconds = time.perf_counter() - start
+
+    # ru_maxrss is in kilobytes on Linux
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print('{:8} {:7.3f} s {:9.0f} MB peak RSS {:9.0f} MB data'.format(fmt, seconds, peak_mb, data_mb))
+
+# Compares loading the corpus from data.csv and from the Parquet cache, each in a fresh process
+def compare_startup(columns):
+    parser = DataParser.__new__(DataParser)
+    parser.load_corpus()
+    if not os.path.exists(path_to_csv):
+        parser.corpus_view().to_csv(path_to_csv, index=False)
+
+    column_args = ['--columns'] + columns if columns else []
+    for fmt in ['csv', 'parquet', 'arrays']:
+        subprocess.run([sys.executable, __file__, 'load', fmt] + column_args, check=True)
+
+
+# Compares the memory used by the normalized token and letter tables to the joined corpus view
+def compare_memory():
+    parser = DataParser.__new__(DataParser)
+    parser.load_corpus()
+    view = parser.corpus_view()
+
+    tokens_mb = parser.tokens.memory_usage(deep=True).sum() / 1024**2
+    letters_mb = parser.letters.memory_usage(deep=True).sum() / 1024**2
+    view_mb = view.memory_usage(deep=True).sum() / 1024**2
+    print('{} tokens, {} letters'.format(len(parser.tokens), len(parser.letters)))
+    print('tokens {:.1f} MB + letters {:.1f} MB = {:.1f} MB, joined view {:.1f} MB ({:.0%} saved)'.format(
+        tokens_mb, letters_mb, tokens_mb + letters_mb, view_mb, 1 - (tokens_mb + letters_mb) / view_mb))
+
+
+# Returns the metadata of a letter and its sender as a dict
+def letter_metadata(parser, id):
+    sender = parser.db_letter.loc[id, 'Sender']
+
+    return {
+        'Year': parser.db_letter.loc[id, 'Year'],
+        'Sender': sender,
+        'SenderRank': parser.db_letter.loc[id, 'SenderRank'],
+        'SenderSex': parser.db_person.loc[sender, 'Sex'],
+        'RelCode': parser.db_letter.loc[id, 'RelCode'],
+        'WordCount': parser.db_letter.loc[id, 'WordCount']
+    }
+
+# Dataframe of one letter with its id, words, POS-tags and metadata, as letters were parsed before
+def parse_letter(parser, path):
+    id, words, pos = parser.read_letter(path)
+
+    # The id and metadata are repeated for each word
+    data = {'ID': [id] * len(pos), 'Words': words, 'Tags': pos}
+    for column, value in letter_metadata(parser, id).items():
+        data[column] = [value] * len(pos)
+
+    return pd.DataFrame(data)
+
+# Ingestion as it was done before: one dataframe per letter with the metadata looked up
+# for each letter, concatenated at the end
+def ingest_per_letter(parser, files):
+    li = [parse_letter(parser, path) for path in files]
+    return pd.concat(li, axis=0, ignore_index=True)
+
+# Ingestion with the tokens of all letters collected first and the metadata merged once
+def ingest_vectorized(parser, files):
+    tokens = parser.letters_to_tokens(files, workers=1)
+    letters = parser.letter_metadata_table(list(tokens['ID'].unique()))
+
+    return tokens.merge(letters, how='left', on='ID').drop(columns=['File'])
+
+# Compares the time and peak traced memory of the two ingestion paths on a sample of letters
+def compare_ingest(sample, seed):
+    parser = DataParser.__new__(DataParser)
+    parser.read_metadata()
+    files = parser.get_letter_files()
+    if sample and sample < len(files):
+        files = sorted(random.Random(seed).sample(files, sample))
+
+    results = {}
+    for name, ingest in [('per-letter', ingest_per_letter), ('vectorized', ingest_vectorized)]:
+        tracemalloc.start()
+        start = time.perf_counter()
+        results[name] = ingest(parser, files)
+        seconds = time.perf_counter() - start
+        peak_mb = tracemalloc.get_traced_memory()[1] / 1024**2
+        tracemalloc.stop()
+        print('{:10} {:7.2f} s {:9.0f} MB peak'.format(name, seconds, peak_mb))
+
+    same = results['per-letter'].astype(str).equals(results['vectorized'].astype(str))
+    print('{} letters, same output: {}'.format(len(files), same))
+
+
+# Parses a sample of letters with one worker and with each number of workers, prints the wall time
+# and the read, parse and join times summed over the workers, and checks the tokens are the same
+def compare_workers(workers, sample, seed):
+    parser = DataParser.__new__(DataParser)
+    files = parser.get_letter_files()
+    if sample and sample < len(files):
+        files = sorted(random.Random(seed).sample(files, sample))
+
+    serial = None
+    same = True
+    for n in [1] + sorted(set(n for n in workers if n > 1)):
+        parser.timings = None
+        start = time.perf_counter()
+        tokens = parser.letters_to_tokens(files, workers=n)
+        seconds = time.perf_counter() - start
+        if serial is None:
+            serial = tokens
+        n_same = tokens.equals(serial)
+        same &= n_same
+        print('{:2} worker(s) {:7.2f} s: read {:.2f} s, parse {:.2f} s, join {:.2f} s, same tokens: {}'.format(
+            n, seconds, parser.timings['read'], parser.timings['parse'], parser.timings['join'], n_same))
+    print('{} letters, {} tokens'.format(len(files), len(serial)))
+
+    return same
+
+
+# Ten line selections for the line graph benchmarks: one per POS category, alternating the sender sex
+def line_specs():
+    ranks = [rank for group in rank_categories['Fine-grained'].values() for rank in group]
+    rels = [rel for group in relationship_categories['Fine-grained'].values() for rel in group]
+    sexes = [['M', 'F'], ['M'], ['F']]
+
+    return [
+        {'name': 'Line {}'.format(i + 1), 'tags': tags, 'sex': sexes[i % 3], 'ranks': ranks, 'rels': rels}
+        for i, tags in enumerate(list(pos_categories.values())[:10])
+    ]
+
+# Tag and word counts per period of one line computed the way the line graph did before,
+# by grouping the whole token table
+def groupby_line(df, spec, edges, labels):
+    bins = pd.IntervalIndex.from_breaks(edges, closed='left')
+    temp = df[['ID', 'Tags', 'SenderSex', 'SenderRank', 'RelCode', 'WordCount']].copy()
+    temp['YearGroup'] = pd.cut(df['Year'].astype('int'), bins=bins)
+    helper_dict = {'Tags': spec['tags'], 'SenderSex': spec['sex'], 'SenderRank': spec['ranks'], 'RelCode': spec['rels']}
+    temp = temp[temp[list(helper_dict)].isin(helper_dict).all(axis=1) & temp['YearGroup'].notna()]
+    temp['YearGroup'] = temp['YearGroup'].cat.codes
+
+    grouped = temp.groupby(['YearGroup', 'ID', 'Tags', 'WordCount'], observed=True).size().to_frame(name='PosCount').reset_index()
+    pos_counts = grouped.groupby('YearGroup')['PosCount'].sum().reindex(range(len(labels)), fill_value=0)
+    word_counts = grouped.groupby(['ID', 'YearGroup'], observed=True)['WordCount'].min().groupby('YearGroup').sum()
+    word_counts = word_counts.reindex(range(len(labels)), fill_value=0)
+
+    return pos_counts.to_numpy(), word_counts.to_numpy()
+
+# Returns the average milliseconds of counts.lines computed without the line cache (cold)
+# and taken from it (warm), and the last result
+def time_lines(counts, lines, edges, labels, repeat):
+    cold = 0.0
+    for i in range(repeat):
+        counts.cache.clear()
+        start = time.perf_counter()
+        result = counts.lines(lines, edges, labels)
+        cold += time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(repeat):
+        counts.lines(lines, edges, labels)
+    warm = time.perf_counter() - start
+
+    return cold / repeat * 1000, warm / repeat * 1000, result
+
+# Times the ten benchmark lines with the letter x tag matrix and the year cube, and checks them
+# against the groupby results for each period length
+def compare_lines(years, period_lengths, repeat):
+    parser = DataParser.__new__(DataParser)
+    parser.load_corpus()
+    start = time.perf_counter()
+    counts = LineCounts(parser)
+    print('Built the year cube in {:.1f} ms ({:.1f} MB)'.format(
+        (time.perf_counter() - start) * 1000, counts.cube.nbytes / 1024**2))
+    df = parser.corpus_view()
+    specs = line_specs()
+    same = True
+
+    for period_length in period_lengths:
+        edges, labels = counts.period_edges(years, period_length)
+
+        cold_ms, warm_ms, (pos_counts, word_counts, rows) = time_lines(counts, specs, edges, labels, repeat)
+        results = list(zip(pos_counts, word_counts))
+
+        start = time.perf_counter()
+        for i in range(repeat):
+            cube_results = [counts.cube_counts(spec['tags'], spec['sex'], spec['ranks'], spec['rels'], edges) for spec in specs]
+        cube_ms = (time.perf_counter() - start) / repeat * 1000
+
+        start = time.perf_counter()
+        expected = [groupby_line(df, spec, edges, labels) for spec in specs]
+        groupby_ms = (time.perf_counter() - start) * 1000
+
+        period_same = all(np.allclose(a, b) for result, exp in zip(results, expected) for a, b in zip(result, exp))
+        period_same &= all(np.allclose(a, exp[0]) for a, exp in zip(cube_results, expected))
+        same &= period_same
+        print('{} lines over {} periods of {} years: lines {:.1f} ms (cached {:.2f} ms), cube lookups {:.2f} ms, groupby {:.1f} ms, same counts: {}'.format(
+            len(specs), len(labels), period_length, cold_ms, warm_ms, cube_ms, groupby_ms, period_same))
+
+    # Time of the lines with one to ten lines selected, computed and taken from the line cache
+    edges, labels = counts.period_edges(years, period_lengths[0])
+    cold_times = []
+    warm_times = []
+    for n in range(1, len(specs) + 1):
+        cold_ms, warm_ms, result = time_lines(counts, specs[:n], edges, labels, repeat)
+        cold_times.append('{}: {:.1f} ms'.format(n, cold_ms))
+        warm_times.append('{}: {:.2f} ms'.format(n, warm_ms))
+    print('Lines by number of lines selected, computed: ' + ', '.join(cold_times))
+    print('Lines by number of lines selected, cached: ' + ', '.join(warm_times))
+
+    return same
+
+
+# Replays typical changes to the line graph and times them with the line cache. Checks each result
+# against computing the lines without the cache and prints the cache counters after each change
+def compare_line_cache(years, period_length, cache_mb):
+    parser = DataParser.__new__(DataParser)
+    parser.load_corpus()
+    counts = LineCounts(parser, cache_bytes=int(cache_mb * 1024**2))
+    specs = line_specs()
+    renamed = [dict(specs[0], name='Renamed')] + specs[1:]
+    retagged = specs[:1] + [dict(specs[1], tags=specs[1]['tags'][:1])] + specs[2:]
+    steps = [
+        ('all lines', specs, period_length),
+        ('same lines again', specs, period_length),
+        ('rename a line', renamed, period_length),
+        ('hide a line', renamed[:2] + renamed[3:], period_length),
+        ('change the tags of a line', retagged, period_length),
+        ('change the period length', retagged, period_length * 2)
+    ]
+
+    same = True
+    for name, lines, length in steps:
+        edges, labels = counts.period_edges(years, length)
+        before = counts.cache.stats()
+        start = time.perf_counter()
+        pos_counts, word_counts, rows = counts.lines(lines, edges, labels)
+        cached_ms = (time.perf_counter() - start) * 1000
+
+        exp_pos, exp_words, exp_rows = counts.compute_lines(lines, edges, labels)
+        exp_rows['Line'] = [lines[i]['name'] for i in exp_rows['Line']]
+        step_same = np.allclose(pos_counts, exp_pos) and np.allclose(word_counts, exp_words) and rows.astype(str).equals(exp_rows.astype(str))
+        same &= step_same
+
+        stats = counts.cache.stats()
+        print('{:26} {:6.1f} ms, {} hits, {} misses, {} lines cached in {:.2f} MB, same: {}'.format(
+            name, cached_ms, stats['hits'] - before['hits'], stats['misses'] - before['misses'],
+            stats['entries'], stats['bytes'] / 1024**2, step_same))
+
+    return same
+
+# Compares sending the rows of the benchmark lines to the bar chart as JSON, as the line graph did
+# before, with keeping them in the result store and sending the token
+def compare_payload(years, period_length, repeat):
+    parser = DataParser.__new__(DataParser)
+    parser.load_corpus()
+    counts = LineCounts(parser)
+    edges, labels = counts.period_edges(years, period_length)
+    rows = counts.lines(line_specs(), edges, labels)[2]
+    store = ResultStore()
+
+    start = time.perf_counter()
+    for i in range(repeat):
+        json = rows.to_json()
+        pd.read_json(io.StringIO(json))
+    json_ms = (time.perf_counter() - start) / repeat * 1000
+
+    start = time.perf_counter()
+    for i in range(repeat):
+        token = store.put(rows)
+        store.get(token)
+    store_ms = (time.perf_counter() - start) / repeat * 1000
+
+    print('{} rows: JSON {:.2f} MB in {:.1f} ms, result store token {} bytes in {:.3f} ms'.format(
+        len(rows), len(json) / 1024**2, json_ms, len(token), store_ms))
+
+# Counts of one bar chart view computed the way the bar chart did before, from the rows of the lines
+def groupby_bars(rows, what_count, group_by):
+    rows = rows.copy()
+    rows['PeopleCount'] = (rows['ID'] != 'Not found').astype(int)
+    rows['LetterCount'] = rows['PeopleCount']
+    if what_count == 'people':
+        rows = rows.groupby(['Sender', 'Line', 'YearGroup']).min().reset_index()
+    else:
+        rows = rows.groupby(['ID', 'Line', 'YearGroup']).min().reset_index()
+    y = {'words': 'WordCount', 'letters': 'LetterCount', 'people': 'PeopleCount'}[what_count]
+
+    return rows.groupby([group_by, 'YearGroup', 'Line'])[y].sum().reset_index()
+
+# Times switching between the nine bar chart views with the precomputed counts and with the groupbys
+# over the rows of the lines, and checks that they give the same counts
+def compare_bars(years, period_length):
+    parser = DataParser.__new__(DataParser)
+    parser.load_corpus()
+    counts = LineCounts(parser)
+    edges, labels = counts.period_edges(years, period_length)
+    rows = counts.lines(line_specs(), edges, labels)[2]
+    views = [(what, attribute) for what in ['words', 'letters', 'people'] for attribute in counts.attributes]
+
+    start = time.perf_counter()
+    bars, totals = counts.bar_counts(rows)
+    precompute_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    results = [bars[view] for view in views]
+    lookup_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    expected = [groupby_bars(rows, what, attribute) for what, attribute in views]
+    groupby_ms = (time.perf_counter() - start) * 1000
+
+    same = all(a.astype(str).equals(b.astype(str)) for a, b in zip(results, expected))
+    print('{} views of {} rows: counts computed in {:.1f} ms and looked up in {:.3f} ms, groupbys {:.1f} ms, same counts: {}'.format(
+        len(views), len(rows), precompute_ms, lookup_ms, groupby_ms, same))
+
+    return same
+
+# Imports the app from the project in path and prints the import time, the number of registered
+# callbacks and the size of the _dash-dependencies response the browser loads on startup.
+# Run it in a fresh process for each version of the app to compare
+def measure_app(path):
+    sys.path.insert(0, os.path.abspath(path))
+    start = time.perf_counter()
+    import index
+    import_s = time.perf_counter() - start
+
+    app = index.app
+    client = app.server.test_client()
+    client.get('/')
+    start = time.perf_counter()
+    response = client.get('/_dash-dependencies')
+    dependencies_ms = (time.perf_counter() - start) * 1000
+
+    print('{}: app imported in {:.2f} s, {} callbacks, _dash-dependencies {:.1f} kB in {:.1f} ms'.format(
+        path, import_s, len(app.callback_map), len(response.data) / 1024, dependencies_ms))
+
+# Filter sets of the line graph and topic model views: the benchmark lines with and without
+# a time window, and the topic model defaults narrowed by sex, rank and years
+def filter_specs(years):
+    specs = [dict(spec, years=None) for spec in line_specs()]
+    specs += [dict(spec, years=years) for spec in line_specs()]
+    tripartite = rank_categories['Tripartite']
+    for sex in [None, 'M', 'F']:
+        for rank in tripartite:
+            specs.append({
+                'tags': pos_categories['nouns'], 'sex': None if sex is None else [sex],
+                'ranks': tripartite[rank], 'rels': None, 'years': years
+            })
+
+    return specs
+
+# Token mask of a filter set computed with pandas over the joined corpus, as the views did before
+def pandas_mask(df, spec):
+    mask = np.ones(len(df), dtype=bool)
+    for col, key in [('Tags', 'tags'), ('SenderSex', 'sex'), ('SenderRank', 'ranks'), ('RelCode', 'rels')]:
+        if spec[key] is not None:
+            mask &= df[col].isin(spec[key]).to_numpy()
+    if spec['years'] is not None:
+        mask &= ((df['Year'] >= spec['years'][0]) & (df['Year'] <= spec['years'][1])).to_numpy()
+
+    return mask
+
+# Times the token masks of typical filter sets from the bitmap indexes and from pandas, and checks they match
+def compare_filters(years, repeat):
+    parser = DataParser.__new__(DataParser)
+    start = time.perf_counter()
+    parser.load_corpus()
+    load_ms = (time.perf_counter() - start) * 1000
+    df = parser.corpus_view()
+    specs = filter_specs(years)
+    index_mb = (parser.tag_index.bits.nbytes + sum(i.bits.nbytes for i in parser.letter_index.values())) / 1024**2
+    print('{} tokens, loaded with the indexes in {:.0f} ms, indexes {:.1f} MB'.format(len(df), load_ms, index_mb))
+
+    start = time.perf_counter()
+    for i in range(repeat):
+        masks = [parser.select_tokens(s['tags'], s['sex'], s['ranks'], s['rels'], s['years']) for s in specs]
+    bitmap_ms = (time.perf_counter() - start) / repeat * 1000
+
+    start = time.perf_counter()
+    for i in range(repeat):
+        expected = [pandas_mask(df, spec) for spec in specs]
+    pandas_ms = (time.perf_counter() - start) / repeat * 1000
+
+    same = all(np.array_equal(a, b) for a, b in zip(masks, expected))
+    print('{} filter sets: bitmaps {:.1f} ms, pandas {:.1f} ms ({:.1f}x), same tokens: {}'.format(
+        len(specs), bitmap_ms, pandas_ms, pandas_ms / bitmap_ms, same))
+
+    return same
+
+# Filters and parameters of the topic model view with its default settings
+def topic_model_defaults():
+    filters = {'tags': pos_categories['nouns'], 'sex': None, 'ranks': None, 'rels': None, 'years': None}
+    parameters = {
+        'userstopwords': ['letter'], 'min_doc': 0, 'max_prop': 1, 'pos_lemmas': False, 'topics': 5, 'iterations': 50,
+        'alpha': 0.5, 'alpha_boolean': False, 'eta': 0.5, 'eta_boolean': False, 'userseed': 135
+    }
+
+    return filters, parameters
+
+# Times training the topic model with the default settings against reading it from the model cache
+def compare_model_cache(path, repeat):
+    import globals
+    globals.initialize()
+    globals.model_cache = ModelCache(path)
+    import callbacks_tm
+    from topic_model import TopicModel
+
+    filters, parameters = topic_model_defaults()
+    start = time.perf_counter()
+    data = globals.topic_model.filter_data(**filters)
+    filter_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    key = globals.model_cache.key(data, parameters)
+    key_ms = (time.perf_counter() - start) * 1000
+
+    globals.model_cache.remove(key)
+    progress = types.SimpleNamespace(update=lambda **counters: None)
+    start = time.perf_counter()
+    trained = callbacks_tm.train_model(progress, key, data, **parameters)
+    train_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(repeat):
+        results, state = globals.model_cache.get(key)
+        TopicModel().set_state(state)
+    read_ms = (time.perf_counter() - start) / repeat * 1000
+
+    same = results == trained[0]
+    print('{} tokens filtered in {:.0f} ms, key in {:.0f} ms'.format(len(data), filter_ms, key_ms))
+    print('training {:.2f} s, cached model {:.1f} ms ({:.1f} MB on disk), same results: {}'.format(
+        train_s, read_ms, globals.model_cache.stats()['bytes'] / 1024**2, same))
+
+    return same
+
+# Documents of the letters made from the words of the tokens at request time, as prepare_data did
+# before the terms were stored with the corpus
+def prepare_per_request(data, userstopwords, min_doc, max_prop):
+    strings = data.groupby(['ID', 'Sender', 'SenderRank', 'SenderSex', 'RelCode', 'Year'], observed=True).agg(lambda col: ' '.join(col))
+    tokenizer = RegexpTokenizer(r'\w+')
+    lemmatizer = WordNetLemmatizer()
+    docs = [tokenizer.tokenize(doc.lower()) for doc in strings['Words']]
+    docs = [[token for token in doc if not token.isnumeric()] for doc in docs]
+    docs = [[token for token in doc if len(token.strip()) > 1] for doc in docs]
+    docs = [[lemmatizer.lemmatize(token) for token in doc] for doc in docs]
+    docs = [[token for token in doc if not token in userstopwords] for doc in docs]
+    dictionary = Dictionary(docs)
+    dictionary.filter_extremes(no_below=min_doc, no_above=max_prop)
+    corpus = [dictionary.doc2bow(doc) for doc in docs]
+
+    return corpus, dictionary, docs, strings
+
+# Times preparing the documents of the default topic model from the stored terms against splitting
+# and lemmatizing the words at request time, and checks that the documents are the same
+def compare_prepare(repeat):
+    import globals
+    globals.initialize()
+    from topic_model import TopicModel
+
+    filters, parameters = topic_model_defaults()
+    data = globals.topic_model.filter_data(**filters)
+    args = [parameters[name] for name in ['userstopwords', 'min_doc', 'max_prop']]
+
+    start = time.perf_counter()
+    for i in range(repeat):
+        expected = prepare_per_request(data, *args)
+    request_ms = (time.perf_counter() - start) / repeat * 1000
+
+    tm = TopicModel()
+    timings = dict.fromkeys(['group', 'terms', 'stopwords', 'dictionary', 'matrix'], 0.0)
+    start = time.perf_counter()
+    for i in range(repeat):
+        corpus, dictionary, strings = tm.prepare_data(data, *args)
+        for step in timings:
+            timings[step] += tm.timings[step] / repeat
+    stored_ms = (time.perf_counter() - start) / repeat * 1000
+
+    same = (list(corpus) == expected[0] and dictionary.token2id == expected[1].token2id
+            and dictionary.dfs == expected[1].dfs and dictionary.cfs == expected[1].cfs
+            and (dictionary.num_docs, dictionary.num_pos, dictionary.num_nnz) == (expected[1].num_docs, expected[1].num_pos, expected[1].num_nnz)
+            and strings.index.equals(expected[3].index))
+    print('{} tokens, {} letters: at request time {:.0f} ms, from stored terms {:.0f} ms ({:.1f}x), same documents: {}'.format(
+        len(data), len(corpus), request_ms, stored_ms, request_ms / stored_ms, same))
+    print(', '.join('{} {:.1f} ms'.format(step, seconds * 1000) for step, seconds in timings.items()))
+
+    return same
+
+# Lists of the words of the letters and the bag-of-words corpus as lists of (id, count) pairs, as
+# prepare_data made them from the stored terms before the letter × term matrix
+def prepare_lists(tm, data, userstopwords, min_doc, max_prop):
+    parser = tm.data_parser
+    groups = data.groupby(['ID', 'Sender', 'SenderRank', 'SenderSex', 'RelCode', 'Year'], observed=True)
+    letters = groups.ngroup().to_numpy()
+    order = np.argsort(letters, kind='stable')
+    terms, counts = parser.token_terms(data.index.to_numpy()[order])
+    term_letters = np.repeat(letters[order], counts)
+    kept = ~parser.term_vocab.isin(userstopwords)[terms]
+    bounds = np.cumsum(np.bincount(term_letters[kept], minlength=groups.ngroups))[:-1]
+    words = parser.term_vocab.to_numpy()[terms[kept]]
+    docs = [doc.tolist() for doc in np.split(words, bounds)]
+    dictionary = Dictionary(docs)
+    dictionary.filter_extremes(no_below=min_doc, no_above=max_prop)
+    corpus = [dictionary.doc2bow(doc) for doc in docs]
+
+    return corpus, dictionary, docs
+
+# Memory taken by the result of the function, and the peak memory while it ran, in bytes
+def traced(function, *args):
+    tracemalloc.start()
+    result = function(*args)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return result, current, peak
+
+# Compares the letter × term matrix of the topic model with the lists of (id, count) pairs it
+# replaced: the time and memory of building them, the time of reading them through, training the
+# model and creating the visualisation from them, and checks that the models are the same
+def compare_corpus(topics, repeat):
+    import globals
+    globals.initialize()
+    from topic_model import TopicModel
+    import pyLDAvis.gensim
+
+    filters, parameters = topic_model_defaults()
+    tm = TopicModel()
+    data = tm.filter_data(**filters)
+    args = [parameters[name] for name in ['userstopwords', 'min_doc', 'max_prop']]
+
+    start = time.perf_counter()
+    for i in range(repeat):
+        lists = prepare_lists(tm, data, *args)
+    lists_ms = (time.perf_counter() - start) / repeat * 1000
+    start = time.perf_counter()
+    for i in range(repeat):
+        tm.prepare_data(data, *args)
+    matrix_ms = (time.perf_counter() - start) / repeat * 1000
+    lists, lists_bytes, lists_peak = traced(prepare_lists, tm, data, *args)
+    prepared, matrix_bytes, matrix_peak = traced(tm.prepare_data, data, *args)
+    corpus, dictionary = prepared[0], prepared[1]
+
+    print('{} letters, {} terms, {} tokens'.format(len(corpus), len(dictionary), corpus.matrix.sum()))
+    print('building: lists {:.0f} ms, matrix {:.0f} ms ({:.1f}x)'.format(lists_ms, matrix_ms, lists_ms / matrix_ms))
+    print('memory: lists {:.2f} MB (peak {:.2f} MB), matrix {:.2f} MB (peak {:.2f} MB)'.format(
+        lists_bytes / 1024**2, lists_peak / 1024**2, matrix_bytes / 1024**2, matrix_peak / 1024**2))
+
+    timings = {}
+    for name, bow in (('lists', lists[0]), ('matrix', corpus)):
+        start = time.perf_counter()
+        for i in range(repeat):
+            for row in bow:
+                pass
+        read_ms = (time.perf_counter() - start) / repeat * 1000
+        start = time.perf_counter()
+        model = tm.train_lda(bow, dictionary, topics, parameters['iterations'], parameters['alpha'], parameters['alpha_boolean'],
+                             parameters['eta'], parameters['eta_boolean'], parameters['userseed'])
+        train_s = time.perf_counter() - start
+        start = time.perf_counter()
+        vis_data = pyLDAvis.gensim.prepare(model, bow if name == 'lists' else corpus.matrix.T, dictionary, sort_topics=False)
+        vis_s = time.perf_counter() - start
+        timings[name] = (model.state.get_lambda(), vis_data.topic_info)
+        print('{}: reading {:.1f} ms, training {:.2f} s, visualisation {:.2f} s'.format(name, read_ms, train_s, vis_s))
+
+    same = (list(corpus) == lists[0] and dictionary.token2id == lists[1].token2id
+            and np.array_equal(timings['lists'][0], timings['matrix'][0])
+            and np.allclose(timings['lists'][1]['Freq'], timings['matrix'][1]['Freq']))
+    print('same corpus, model and visualisation: {}'.format(same))
+
+    return same
+
+# Times lemmatizing each token of the corpus against lemmatizing each word type once and looking
+# the terms of the tokens up, checks that the terms are the same and counts the tokens whose terms
+# change when they are lemmatized by their POS-tags
+def compare_lemmas():
+    parser = DataParser.__new__(DataParser)
+    parser.load_corpus()
+    tokenizer = RegexpTokenizer(r'\w+')
+    lemmatizer = WordNetLemmatizer()
+
+    start = time.perf_counter()
+    expected = []
+    for lower in parser.lower_vocab[parser.lower_ids]:
+        terms = [token for token in tokenizer.tokenize(lower) if not token.isnumeric()]
+        expected.extend(lemmatizer.lemmatize(token) for token in terms if len(token.strip()) > 1)
+    token_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    parser.type_terms(parser.lower_vocab)
+    type_s = time.perf_counter() - start
+
+    tokens = np.arange(len(parser.lower_ids))
+    start = time.perf_counter()
+    terms, counts = parser.token_terms(tokens)
+    lookup_ms = (time.perf_counter() - start) * 1000
+    pos_terms, counts = parser.token_terms(tokens, pos=True)
+    changed = len(np.unique(np.repeat(tokens, counts)[terms != pos_terms]))
+
+    same = parser.term_vocab[terms].tolist() == expected
+    print('{} tokens, {} word types: lemmatizing the tokens {:.1f} s, the types {:.1f} s ({:.0f}x)'.format(
+        len(tokens), len(parser.lower_vocab), token_s, type_s, token_s / type_s))
+    print('terms of all tokens looked up in {:.0f} ms, same terms: {}, tokens changed by POS lemmas: {} ({:.1%})'.format(
+        lookup_ms, same, changed, changed / len(tokens)))
+
+    return same
+
+# Trains the topic model with the default settings and the given number of topics
+def train_default_model(topics):
+    import globals
+    globals.initialize()
+    from topic_model import TopicModel
+
+    filters, parameters = topic_model_defaults()
+    tm = TopicModel()
+    data = tm.filter_data(**filters)
+    tm.prepare_data(data, parameters['userstopwords'], parameters['min_doc'], parameters['max_prop'], parameters['pos_lemmas'])
+    tm.train_lda(tm.corpus, tm.dictionary, topics, parameters['iterations'], parameters['alpha'], parameters['alpha_boolean'],
+                 parameters['eta'], parameters['eta_boolean'], parameters['userseed'])
+
+    return tm
+
+# Times finding the dominant topic of each letter one letter at a time against the batched inference,
+# and checks they are the same. Both start from the same random state of the model
+def compare_letter_topics(topics):
+    tm = train_default_model(topics)
+    model = copy.deepcopy(tm.model)
+
+    start = time.perf_counter()
+    expected = []
+    for row in model[tm.corpus]:
+        topic, score = sorted(row, key=lambda x: x[1], reverse=True)[0]
+        expected.append((int(topic) + 1, round(score, 4)))
+    letter_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    dominant = tm.letter_topics()
+    batch_s = time.perf_counter() - start
+
+    same = expected == list(zip(dominant['Dominant topic'], dominant['Contribution of topic to letter']))
+    print('{} letters, {} topics: one letter at a time {:.2f} s, batched {:.2f} s ({:.1f}x), same topics: {}'.format(
+        len(tm.corpus), topics, letter_s, batch_s, letter_s / batch_s, same))
+
+    return same
+
+# Representative letters of each topic as they were listed before, by sorting the letters of each
+# dominant topic
+def groupby_representative(dominant_topics, n):
+    topics_sorted = pd.DataFrame()
+    for i, grp in dominant_topics.groupby('Dominant topic'):
+        topics_sorted = pd.concat([topics_sorted, grp.sort_values(['Contribution of topic to letter'], ascending=[0]).head(n)], axis=0)
+
+    return topics_sorted
+
+# Times finding the representative letters of the topics by sorting the letters of each dominant topic
+# against argpartition on the letter × topic matrix, and checks that the contributions listed for
+# each topic are the same. Letters with equal rounded contributions may be listed in another order
+def compare_representative(topics, repeat):
+    tm = train_default_model(topics)
+    dominant = tm.letter_topics()
+    n = tm.representative_letters
+
+    start = time.perf_counter()
+    for i in range(repeat):
+        expected = groupby_representative(dominant, n)
+    groupby_ms = (time.perf_counter() - start) / repeat * 1000
+
+    start = time.perf_counter()
+    for i in range(repeat):
+        tm.get_most_representative(dominant)
+    top_ms = (time.perf_counter() - start) / repeat * 1000
+
+    same = True
+    for topic in range(1, topics + 1):
+        rows = expected.loc[expected['Dominant topic'] == topic]
+        listed = tm.get_topic_letters(topic)
+        same = same and list(rows['Contribution of topic to letter'].round(3)) == list(listed['Contribution of topic to letter'])
+    print('{} letters, {} topics: groupby {:.2f} ms, argpartition {:.2f} ms ({:.1f}x), same contributions: {}'.format(
+        len(dominant), topics, groupby_ms, top_ms, groupby_ms / top_ms, same))
+
+    return same
+
+# Times training the topic model with the default settings, creating its visualisation and reading
+# the visualisation from the cache, and checks that a model trained again with the same seed has the
+# same hash, so that its visualisation is found in the cache
+def compare_visualisation(path, repeat):
+    import globals
+    globals.initialize()
+    globals.vis_cache = ModelCache(path)
+    import callbacks_tm
+    callbacks_tm.vis_cache = globals.vis_cache
+
+    filters, parameters = topic_model_defaults()
+    data = globals.topic_model.filter_data(**filters)
+    progress = types.SimpleNamespace(update=lambda **counters: None)
+    hashes = []
+    for i in range(2):
+        start = time.perf_counter()
+        results, state = callbacks_tm.train_model(progress, None, data, **parameters)
+        train_s = time.perf_counter() - start
+        hashes.append(state['model_hash'])
+
+    model = globals.topic_model
+    model.set_state(state)
+    globals.vis_cache.remove(model.model_hash)
+    start = time.perf_counter()
+    html_vis = callbacks_tm.create_visualisation(progress, model)
+    vis_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(repeat):
+        cached = globals.vis_cache.get(model.model_hash)
+    read_ms = (time.perf_counter() - start) / repeat * 1000
+
+    same = hashes[0] == hashes[1] and cached == html_vis
+    print('training {:.2f} s, visualisation {:.2f} s, cached visualisation {:.1f} ms ({:.0f} kB), same model hash and visualisation: {}'.format(
+        train_s, vis_s, read_ms, len(html_vis) / 1024, same))
+
+    return same
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Measurements and consistency checks for the data pipeline')
+    commands = arg_parser.add_subparsers(dest='command', required=True)
+
+    parsers_cmd = commands.add_parser('parsers', help='check that the streaming parser matches BeautifulSoup')
+    parsers_cmd.add_argument('--sample', type=int, default=200, help='number of letters to compare, 0 for all')
+    parsers_cmd.add_argument('--seed', type=int, default=0)
+
+    startup_cmd = commands.add_parser('startup', help='compare loading the corpus from CSV and from Parquet')
+    startup_cmd.add_argument('--columns', nargs='+', help='load only these columns')
+
+    load_cmd = commands.add_parser('load', help='load the corpus in one format (used by startup)')
+    load_cmd.add_argument('format', choices=['csv', 'parquet', 'arrays'])
+    load_cmd.add_argument('--columns', nargs='+')
+
+    ingest_cmd = commands.add_parser('ingest', help='compare per-letter and vectorized metadata joins in ingestion')
+    ingest_cmd.add_argument('--sample', type=int, default=0, help='number of letters to ingest, 0 for all')
+    ingest_cmd.add_argument('--seed', type=int, default=0)
+
+    workers_cmd = commands.add_parser('workers', help='time parsing the letters with a process pool and check it against one worker')
+    workers_cmd.add_argument('--workers', type=int, nargs='+', default=[2, 4, os.cpu_count()])
+    workers_cmd.add_argument('--sample', type=int, default=0, help='number of letters to parse, 0 for all')
+    workers_cmd.add_argument('--seed', type=int, default=0)
+
+    lines_cmd = commands.add_parser('lines', help='time the line graph counts and check them against a groupby')
+    lines_cmd.add_argument('--years', type=int, nargs=2, default=[1680, 1800])
+    lines_cmd.add_argument('--periods', type=int, nargs='+', default=[1, 5, 10, 20, 50])
+    lines_cmd.add_argument('--repeat', type=int, default=10)
+
+    cache_cmd = commands.add_parser('cache', help='replay changes to the line graph with the line cache')
+    cache_cmd.add_argument('--years', type=int, nargs=2, default=[1680, 1800])
+    cache_cmd.add_argument('--period', type=int, default=20)
+    cache_cmd.add_argument('--cache-mb', type=float, default=LineCounts.cache_bytes / 1024**2)
+
+    payload_cmd = commands.add_parser('payload', help='compare sending the bar chart rows as JSON and as a token')
+    payload_cmd.add_argument('--years', type=int, nargs=2, default=[1680, 1800])
+    payload_cmd.add_argument('--period', type=int, default=20)
+    payload_cmd.add_argument('--repeat', type=int, default=10)
+
+    bars_cmd = commands.add_parser('bars', help='time the bar chart views and check them against the groupbys')
+    bars_cmd.add_argument('--years', type=int, nargs=2, default=[1680, 1800])
+    bars_cmd.add_argument('--period', type=int, default=20)
+
+    app_cmd = commands.add_parser('app', help='measure the startup, callbacks and dependency payload of the app')
+    app_cmd.add_argument('--path', default='.', help='project directory to import the app from')
+
+    filters_cmd = commands.add_parser('filters', help='time token filters from the bitmap indexes against pandas masks')
+    filters_cmd.add_argument('--years', type=int, nargs=2, default=[1700, 1750])
+    filters_cmd.add_argument('--repeat', type=int, default=10)
+
+    models_cmd = commands.add_parser('models', help='time training the topic model against reading it from the model cache')
+    models_cmd.add_argument('--path', default=ModelCache.path, help='directory of the model cache')
+    models_cmd.add_argument('--repeat', type=int, default=10)
+
+    prepare_cmd = commands.add_parser('prepare', help='time preparing the topic model documents from the stored terms')
+    prepare_cmd.add_argument('--repeat', type=int, default=5)
+
+    letter_topics_cmd = commands.add_parser('letter-topics', help='time the dominant topics of the letters one at a time and batched')
+    letter_topics_cmd.add_argument('--topics', type=int, default=5)
+
+    visualisation_cmd = commands.add_parser('visualisation', help='time the visualisation of the topic model against reading it from the cache')
+    visualisation_cmd.add_argument('--path', default='TCEECE/visualisations', help='directory of the visualisation cache')
+    visualisation_cmd.add_argument('--repeat', type=int, default=10)
+
+    corpus_cmd = commands.add_parser('corpus', help='compare the letter × term matrix of the topic model with lists of (id, count) pairs')
+    corpus_cmd.add_argument('--topics', type=int, default=5)
+    corpus_cmd.add_argument('--repeat', type=int, default=5)
+
+    representative_cmd = commands.add_parser('representative', help='time the representative letters of the topics with groupby and argpartition')
+    representative_cmd.add_argument('--topics', type=int, default=5)
+    representative_cmd.add_argument('--repeat', type=int, default=10)
+
+    commands.add_parser('lemmas', help='compare lemmatizing each token with looking up the lemmas of the word types')
+
+    commands.add_parser('memory', help='compare the memory of the normalized tables and the joined corpus')
+
+    args = arg_parser.parse_args()
+
+    if args.command == 'parsers':
+        mismatches = check_parsers(args.sample, args.seed)
+        raise SystemExit(1 if mismatches else 0)
+    elif args.command == 'startup':
+        compare_startup(args.columns)
+    elif args.command == 'load':
+        load_corpus(args.format, args.columns)
+    elif args.command == 'ingest':
+        compare_ingest(args.sample, args.seed)
+    elif args.command == 'workers':
+        same = compare_workers(args.workers, args.sample, args.seed)
+        raise SystemExit(0 if same else 1)
+    elif args.command == 'lines':
+        same = compare_lines(args.years, args.periods, args.repeat)
+        raise SystemExit(0 if same else 1)
+    elif args.command == 'cache':
+        same = compare_line_cache(args.years, args.period, args.cache_mb)
+        raise SystemExit(0 if same else 1)
+    elif args.command == 'payload':
+        compare_payload(args.years, args.period, args.repeat)
+    elif args.command == 'bars':
+        same = compare_bars(args.years, args.period)
+        raise SystemExit(0 if same else 1)
+    elif args.command == 'app':
+        measure_app(args.path)
+    elif args.command == 'filters':
+        same = compare_filters(args.years, args.repeat)
+        raise SystemExit(0 if same else 1)
+    elif args.command == 'models':
+        same = compare_model_cache(args.path, args.repeat)
+        raise SystemExit(0 if same else 1)
+    elif args.command == 'prepare':
+        same = compare_prepare(args.repeat)
+        raise SystemExit(0 if same else 1)
+    elif args.command == 'letter-topics':
+        same = compare_letter_topics(args.topics)
+        raise SystemExit(0 if same else 1)
+    elif args.command == 'visualisation':
+        same = compare_visualisation(args.path, args.repeat)
+        raise SystemExit(0 if same else 1)
+    elif args.command == 'corpus':
+        same = compare_corpus(args.topics, args.repeat)
+        raise SystemExit(0 if same else 1)
+    elif args.command == 'representative':
+        same = compare_representative(args.topics, args.repeat)
+        raise SystemExit(0 if same else 1)
+    elif args.command == 'lemmas':
+        same = compare_lemmas()
+        raise SystemExit(0 if same else 1)
+    elif args.command == 'memory':
+        compare_memory()
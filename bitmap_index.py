@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+
+
+class BitmapIndex:
+
+    # Bitmaps of the rows that have each value of a column, packed eight rows to a byte.
+    # bits[i] is the bitmap of values[i], size is the number of rows
+    def __init__(self, values, bits, size):
+        self.values = pd.Index(values)
+        self.bits = bits
+        self.size = size
+        return
+
+    # Builds the index of a column from its integer codes, which index values. Bits of different
+    # rows never fall in the same place of a byte, so summing them per byte sets them all
+    @classmethod
+    def from_codes(cls, codes, values):
+        codes = np.asarray(codes)
+        n_bytes = (len(codes) + 7) // 8
+        rows = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[rows], np.arange(len(values) + 1))
+
+        bits = np.zeros((len(values), n_bytes), dtype=np.uint8)
+        for i in range(len(values)):
+            value_rows = rows[bounds[i]:bounds[i+1]]
+            weights = np.left_shift(1, 7 - (value_rows & 7))
+            bits[i] = np.bincount(value_rows >> 3, weights=weights, minlength=n_bytes)
+
+        return cls(values, bits, len(codes))
+
+    # Bitmap of the rows that have any of the given values. Values not in the index are left out,
+    # and None selects all rows
+    def any(self, values):
+        if values is None:
+            return self.all()
+        codes = self.values.get_indexer(values)
+        codes = codes[codes >= 0]
+        if len(codes) == 0:
+            return self.none()
+
+        return np.bitwise_or.reduce(self.bits[codes], axis=0)
+
+    # Bitmap of the rows whose value is between low and high, both included. The values must be sorted
+    def between(self, low, high):
+        start = self.values.searchsorted(low, side='left')
+        end = self.values.searchsorted(high, side='right')
+        if start >= end:
+            return self.none()
+
+        return np.bitwise_or.reduce(self.bits[start:end], axis=0)
+
+    # Bitmap with all rows set. The padding bits of the last byte stay unset
+    def all(self):
+        return np.packbits(np.ones(self.size, dtype=bool))
+
+    # Bitmap with no rows set
+    def none(self):
+        return np.zeros(self.bits.shape[1], dtype=np.uint8)
+
+    # Unpacks a bitmap of this index into a boolean array with one item per row
+    def mask(self, bitmap):
+        return np.unpackbits(bitmap, count=self.size).astype(bool)
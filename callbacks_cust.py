@@ -1,5 +1,5 @@
 import dash
-from dash.dependencies import Input, Output, State
+from dash.dependencies import Input, Output, State, ALL
 import dash_core_components as dcc
 import dash_html_components as html
 from dash.exceptions import PreventUpdate
@@ -40,15 +40,16 @@ def view_pos_groups(data):
         return children
 
 
-for i in range (0,11):
-    @app.callback(
-        Output(f'pos_groups_dropdown_{i}_main', 'options'),
-        Input('user-pos-store', 'data'))
-    def include_pos_groups_line(data):
+# Updates the options of the POS-tag group selectors of all lines
+@app.callback(
+    Output({'type': 'pos_groups_dropdown_main', 'index': ALL}, 'options'),
+    Input('user-pos-store', 'data'),
+    State({'type': 'pos_groups_dropdown_main', 'index': ALL}, 'id'))
+def include_pos_groups_line(data, ids):
 
-        if data is not None:
-            return data_parser.list_to_dash_option_dict(list(data_parser.get_pos_categories(data).keys()))
-        return data_parser.list_to_dash_option_dict(list(data_parser.pos_categories.keys()))
+    if data is not None:
+        return [data_parser.list_to_dash_option_dict(list(data_parser.get_pos_categories(data).keys()))] * len(ids)
+    return [data_parser.list_to_dash_option_dict(list(data_parser.pos_categories.keys()))] * len(ids)
 
 
 @app.callback(
@@ -93,15 +94,16 @@ def view_rel_groups(data):
         
         return children
 
-for i in range (0,11):
-    @app.callback(
-        Output(f'line_relationship_main_{i}', 'options'),
-        Input('user-relationship-store', 'data'))
-    def include_rel_groups_line(data):
+# Updates the options of the relationship group selectors of all lines
+@app.callback(
+    Output({'type': 'line_relationship_main', 'index': ALL}, 'options'),
+    Input('user-relationship-store', 'data'),
+    State({'type': 'line_relationship_main', 'index': ALL}, 'id'))
+def include_rel_groups_line(data, ids):
 
-        if data is not None:
-            return data_parser.list_to_dash_option_dict(list(data_parser.get_rel_categories(data).keys()))
-        return data_parser.list_to_dash_option_dict(list(data_parser.relationship_categories.keys()))
+    if data is not None:
+        return [data_parser.list_to_dash_option_dict(list(data_parser.get_rel_categories(data).keys()))] * len(ids)
+    return [data_parser.list_to_dash_option_dict(list(data_parser.relationship_categories.keys()))] * len(ids)
     
 @app.callback(
     Output('relationship-main', 'options'),
@@ -143,15 +145,16 @@ def view_rank_groups(data):
         
         return children
     
-for i in range (0,11):
-    @app.callback(
-        Output(f'line_senderrank_main_{i}', 'options'),
-        Input('user-rank-store', 'data'))
-    def include_rank_groups_line(data):
-
-        if data is not None:
-            return data_parser.list_to_dash_option_dict(list(data_parser.get_rank_categories(data).keys()))
-        return data_parser.list_to_dash_option_dict(list(data_parser.rank_categories.keys()))
+# Updates the options of the rank group selectors of all lines
+@app.callback(
+    Output({'type': 'line_senderrank_main', 'index': ALL}, 'options'),
+    Input('user-rank-store', 'data'),
+    State({'type': 'line_senderrank_main', 'index': ALL}, 'id'))
+def include_rank_groups_line(data, ids):
+
+    if data is not None:
+        return [data_parser.list_to_dash_option_dict(list(data_parser.get_rank_categories(data).keys()))] * len(ids)
+    return [data_parser.list_to_dash_option_dict(list(data_parser.rank_categories.keys()))] * len(ids)
     
 @app.callback(
     Output('rank-main', 'options'),
@@ -1,5 +1,5 @@
 import dash
-from dash.dependencies import Input, Output, State
+from dash.dependencies import Input, Output, State, MATCH, ALL, ClientsideFunction
 import dash_core_components as dcc
 import dash_html_components as html
 from dash.exceptions import PreventUpdate
@@ -14,10 +14,12 @@ import time
 
 from app import app
 import globals
+from line_counts import LineCounts
 
 data_parser = globals.data_parser
+result_store = globals.result_store
 
-df = data_parser.df
+line_counts = LineCounts(data_parser)
 
 
 # Callback for the slider element
@@ -31,90 +33,35 @@ def set_years(selected_years):
     return years, selected_years
 
 
-for i in range (0,11):
-    @app.callback(
-        Output(f'pos_groups_dropdown_{i}_sub', 'value'),
-        Output(f'pos_groups_dropdown_{i}_sub', 'options'),
-        [Input(f'pos_groups_dropdown_{i}_main', 'value')],
-        State('user-pos-store', 'data'))
-    def line_group_pos_options(mains, data):
-
-        values = []
-        options = []
-        for main in mains:
-            value = data_parser.get_pos_categories(data)[main]
-            values.extend(value)
-            options.extend(data_parser.pos_options_with_hover(data, main))
-        
-        return values, options
-
-
-for i in range (0,11):
-    @app.callback(
-        Output(f'line_senderrank_sub_{i}', 'value'),
-        Output(f'line_senderrank_sub_{i}', 'options'),
-        Input(f'line_senderrank_main_{i}', 'value'),
-        State('user-rank-store', 'data'))
-    def line_group_rank_options(main, data):
-
-        values = []
-        options = []
-        value = data_parser.get_rank_categories(data)[main]
-        values.extend(value)
-        options.extend(data_parser.dict_to_dash_options_with_hover(data_parser.get_rank_categories(data)[main]))
-        
-        return values, options
-
-for i in range (0,11):
-    @app.callback(
-        Output(f'line_relationship_sub_{i}', 'value'),
-        Output(f'line_relationship_sub_{i}', 'options'),
-        Input(f'line_relationship_main_{i}', 'value'),
-        State('user-relationship-store', 'data'))
-    def line_group_rel_options(main, data):
-
-        values = []
-        options = []
-        value = data_parser.get_rel_categories(data)[main]
-        values.extend(value)
-        options.extend(data_parser.dict_to_dash_options_with_hover(data_parser.get_rel_categories(data)[main]))
-        
-        return values, options
-
-for i in range(1,11):
-    @app.callback(
-        Output(f'line_store_{i}', 'data'),
-        Input('update_line_button', 'n_clicks'), # Only pressing the button initiates the function
-        Input('update_line_button_1', 'n_clicks'), # Only pressing the button initiates the function
-        Input('dummy_div', 'children'),
-        Input(f'line_name_{i}', 'value'),
-        [Input(f'pos_groups_dropdown_{i}_sub', 'value')],
-        [Input(f'line_sex_{i}', 'value')],
-        Input(f'line_senderrank_main_{i}', 'value'),
-        [Input(f'line_senderrank_sub_{i}', 'value')],
-        Input(f'line_relationship_main_{i}', 'value'),
-        [Input(f'line_relationship_sub_{i}', 'value')])
-    def save_selection(clicks1, clicks2, aux, name, pos_sub, sex, rank_main, rank_sub, rel_main, rel_sub):
-        return {
-            'name': name,
-            'pos_sub': pos_sub,
-            'sex': sex,
-            'rank_main': rank_main,
-            'rank_sub': rank_sub,
-            'rel_main': rel_main,
-            'rel_sub': rel_sub
-        }
-
-
-def initial_poscount_groupby(df):
-    return df.groupby(['YearGroup', 'ID', 'Sender', 'SenderSex', 'SenderRank', 'RelCode', 'Tags', 'WordCount']).size().to_frame(name = 'PosCount').reset_index()
-
-def wordcount_groupby(df):
-    return df.groupby(['ID','YearGroup']).min().reset_index().groupby(['YearGroup']).sum().reset_index()['WordCount']
-
-def poscount_groupby(df):
-    return df.groupby(['YearGroup']).sum().reset_index()['PosCount']
+# Callbacks of the selectors of the lines match the selectors by the index of their line.
+# Index 0 is the selection applied to all lines. The options of the groups are looked up in the browser
+app.clientside_callback(
+    ClientsideFunction(namespace='categories', function_name='pos_options_with_hover'),
+    Output({'type': 'pos_groups_dropdown_sub', 'index': MATCH}, 'value'),
+    Output({'type': 'pos_groups_dropdown_sub', 'index': MATCH}, 'options'),
+    [Input({'type': 'pos_groups_dropdown_main', 'index': MATCH}, 'value')],
+    State('user-pos-store', 'data'),
+    State('category-tables', 'data'))
+
+app.clientside_callback(
+    ClientsideFunction(namespace='categories', function_name='rank_options'),
+    Output({'type': 'line_senderrank_sub', 'index': MATCH}, 'value'),
+    Output({'type': 'line_senderrank_sub', 'index': MATCH}, 'options'),
+    Input({'type': 'line_senderrank_main', 'index': MATCH}, 'value'),
+    State('user-rank-store', 'data'),
+    State('category-tables', 'data'))
+
+app.clientside_callback(
+    ClientsideFunction(namespace='categories', function_name='relationship_options'),
+    Output({'type': 'line_relationship_sub', 'index': MATCH}, 'value'),
+    Output({'type': 'line_relationship_sub', 'index': MATCH}, 'options'),
+    Input({'type': 'line_relationship_main', 'index': MATCH}, 'value'),
+    State('user-relationship-store', 'data'),
+    State('category-tables', 'data'))
 
+
+# The selections of all lines are read with ALL and looked up by the index in their ids: the
+# selection applied to all lines has index 0, and the lines 1 to 10 have their own numbers
 @app.callback(
     Output('line_graph', 'figure'), 
     Output('bar_df', 'children'),
@@ -124,13 +71,13 @@ def poscount_groupby(df):
     State('line_graph_name', 'value'),
     [State('inherit_pos', 'value')],
     [State('inherit_attributes', 'value')],
-    [State('pos_groups_dropdown_0_sub', 'value')],
-    [State('line_sex_0', 'value')],
-    State('line_senderrank_main_0', 'value'),
-    [State('line_senderrank_sub_0', 'value')],
-    State('line_relationship_main_0', 'value'),
-    [State('line_relationship_sub_0', 'value')],
-    [State(f'line_store_{i}', 'data') for i in range(1,11)],
+    State({'type': 'line_name', 'index': ALL}, 'value'),
+    State({'type': 'pos_groups_dropdown_sub', 'index': ALL}, 'value'),
+    State({'type': 'line_sex', 'index': ALL}, 'value'),
+    State({'type': 'line_senderrank_main', 'index': ALL}, 'value'),
+    State({'type': 'line_senderrank_sub', 'index': ALL}, 'value'),
+    State({'type': 'line_relationship_main', 'index': ALL}, 'value'),
+    State({'type': 'line_relationship_sub', 'index': ALL}, 'value'),
     [State('line_period_length', 'value')],
     [State('line_time_slider', 'value')],
     [State('line_visibility', 'value')],
@@ -139,73 +86,47 @@ def poscount_groupby(df):
     State('user-rank-store', 'data'))
 def display_line_graph(
     n_clicks, n_clicks_1, graph_name, inherit_pos, inherit_attributes, 
-    pos_sub_0, sex_0, rank_main_0, rank_sub_0, rel_main_0, rel_sub_0, 
-    line1, line2, line3, line4, line5, line6, line7, line8, line9, line10, 
+    names, pos_subs, sexes, rank_mains, rank_subs, rel_mains, rel_subs,
     periods, years, visibility, custom_pos, custom_rel, custom_rank):
 
+    # Values of the ALL states by the type and the index of their ids
+    states = {}
+    for group in dash.callback_context.states_list:
+        if isinstance(group, list):
+            for state in group:
+                states.setdefault(state['id']['type'], {})[state['id']['index']] = state.get('value')
+
+    selections = {
+        i: {
+            'pos_sub': states['pos_groups_dropdown_sub'][i],
+            'sex': states['line_sex'][i],
+            'rank_main': states['line_senderrank_main'][i],
+            'rank_sub': states['line_senderrank_sub'][i],
+            'rel_main': states['line_relationship_main'][i],
+            'rel_sub': states['line_relationship_sub'][i]
+        } for i in states['pos_groups_dropdown_sub']
+    }
+    pos_sub_0 = selections[0]['pos_sub']
+    sex_0 = selections[0]['sex']
+    rank_main_0 = selections[0]['rank_main']
+    rank_sub_0 = selections[0]['rank_sub']
+    rel_main_0 = selections[0]['rel_main']
+    rel_sub_0 = selections[0]['rel_sub']
+
+    line_dict = {}
+    for i, name in states.get('line_name', {}).items():
+        line_dict[i] = dict(selections[i], name=name)
+
     if n_clicks == 0 and n_clicks_1 == 0:
-        line1 = {
-            'name': 'Line 1',
-            'pos_sub': pos_sub_0,
-            'sex': sex_0,
-            'rank_main': rank_main_0,
-            'rank_sub': rank_sub_0,
-            'rel_main': rel_main_0,
-            'rel_sub': rel_sub_0
-        }
-
-    start = years[0]
-    end = years[1]
-    full_period = end - start
-    modulo = full_period % periods
-
-    if modulo == 0:
-        end_a = end - periods
-        end_b = end_a + periods + 1
-    else:
-        end_a = end - modulo
-        end_b = end_a + modulo + 1
-
-    starts = np.arange(start, end_a, periods).tolist()
-    tuples = [(start, start+periods) for start in starts]
-    tuples.append(tuple([end_a, end_b]))
-
-    bins = pd.IntervalIndex.from_tuples(tuples, closed='left')
-    
-    original_labels = list(bins.astype(str))
-    new_labels = ['{} - {}'.format(b.strip('[)').split(', ')[0], int(b.strip('[)').split(', ')[1])-1) for b in list(bins.astype(str))]
-    label_dict = dict(zip(original_labels, new_labels))
-
-    df = data_parser.df.copy()
-    
-    # Assign each row to a period
-    df['Year'] = df['Year'].astype('int')
-    df['YearGroup'] = pd.cut(df['Year'], bins=bins,include_lowest=True, labels=new_labels, precision=0)
-    df['YearGroup'] = df['YearGroup'].astype("str")
-    df = df.replace(label_dict)
-
-    # Group the data to get count of each POS tag in the data
-    # df = poscount_groupby(df)
-    df = initial_poscount_groupby(df)
+        line_dict[1] = dict(selections[0], name='Line 1')
+
+    edges, new_labels = line_counts.period_edges(years, periods)
 
     fig = go.Figure()
-    lines_df = pd.DataFrame()
-
-    line_dict = {
-        1: line1,
-        2: line2,
-        3: line3,
-        4: line4,
-        5: line5,
-        6: line6,
-        7: line7,
-        8: line8,
-        9: line9,
-        10: line10
-    }
 
     # Visibility list is sorted to have them in the natural order user is expecting regardless of the choosing order
     visibility.sort()
+    lines = []
     for line in visibility:
         
         if '1' in inherit_pos:
@@ -225,46 +146,21 @@ def display_line_graph(
             rel_main = line_dict[line]['rel_main']
             rel_sub = line_dict[line]['rel_sub']
 
-        helper_dict = {
-            'Tags': pos_sub,
-            'SenderSex': sex,
-            'SenderRank': list(flatten([data_parser.get_rank_categories(custom_rank)[rank_main][sub] for sub in rank_sub])),
-            'RelCode': list(flatten([data_parser.get_rel_categories(custom_rel)[rel_main][sub] for sub in rel_sub]))
-        }
-        # mask 1
-        mask = df[['Tags', 'SenderSex', 'SenderRank', 'RelCode']].isin(helper_dict).all(axis=1)
-        temp = df[mask].copy()
-        
-        # Grouping by desired attributes may lead to loss of some periods
-        # Here we add mock data for those periods so the graph is shown correctly
-        for p in new_labels:
-            if p not in list(temp['YearGroup'].unique()):
-                temp = temp.append(
-                    {
-                        'YearGroup': p,
-                        'ID': 'Not found',
-                        'Sender': 'Not found',
-                        'SenderSex': 'Not found',
-                        'SenderRank': 'Not found',
-                        'RelCode': 'Not found',
-                        'Tags': 'Not found',
-                        'WordCount': 0,
-                        'PosCount': 0
-                    }, ignore_index=True
-                )
-
-        word_counts = wordcount_groupby(temp)
-        pos_counts = poscount_groupby(temp)
+        ranks = list(flatten([data_parser.get_rank_categories(custom_rank)[rank_main][sub] for sub in rank_sub]))
+        rels = list(flatten([data_parser.get_rel_categories(custom_rel)[rel_main][sub] for sub in rel_sub]))
+        lines.append({'name': line_dict[line]['name'], 'tags': pos_sub, 'sex': sex, 'ranks': ranks, 'rels': rels})
+
+    # Counts of the selected tags and words of all lines per period, and the rows of the lines for the bar chart.
+    # Periods without letters have a mock row in lines_df so the bar chart is shown correctly
+    pos_counts, word_counts, lines_df = line_counts.lines(lines, edges, new_labels)
 
+    for i, line in enumerate(lines):
         fig.add_scatter(
             x=new_labels, 
-            y=(pos_counts/word_counts).fillna(0)*100,
-            name=line_dict[line]['name'],
+            y=(pd.Series(pos_counts[i])/pd.Series(word_counts[i])).fillna(0)*100,
+            name=line['name'],
             showlegend=True,
             connectgaps=True)
-        # Append to DF for bar chart
-        temp['Line'] = [line_dict[line]['name']] * len(temp.index)
-        lines_df = lines_df.append(temp)
 
     fig.update_layout(
         title=graph_name,
@@ -276,24 +172,16 @@ def display_line_graph(
     # tozero mode forces y axis to start from zero to avoid misleading visualizations
     fig.update_yaxes(rangemode='tozero')
 
-    # Different lines having same POS messes up the dataframe index 
-    # which then messes up json converting, creating new index solves this
-    lines_df.reset_index(drop=True, inplace=True)
-    
     # Makes a list of the line names in right order to be sent to the bar graph
     line_names = [[value["name"] for key, value in line_dict.items() if value is not None][i] for i in np.array(visibility)-1]
 
-    return fig, lines_df.to_json(), line_names
+    # The counts for the bar chart are computed once for all of its views and kept on the server,
+    # only their token is sent to the browser
+    return fig, result_store.put(line_counts.bar_counts(lines_df)), line_names
 
     #return go.Figure(), pd.DataFrame(columns=['YearGroup', 'ID', 'Sender', 'SenderSex', 'SenderRank', 'RelCode', 'WordCount', 'Line']).to_json()
 
 
-def line_groupby_id(df):
-    return df.groupby(['ID', 'Line', 'YearGroup']).min().reset_index()
-
-def line_groupby_sender(df):    
-    return df.groupby(['Sender', 'Line', 'YearGroup']).min().reset_index()
-
 # Testing wordcount bar chart
 @app.callback(
     Output('count_bar_chart', 'figure'), 
@@ -302,37 +190,19 @@ def line_groupby_sender(df):
     Input('bar_names', 'children'),
     Input('bar_what_count', 'value'),
     Input('bar_groub_by', 'value'))
-def display_wordcount_chart(json, line_names, what_count, group_by_what):
+def display_wordcount_chart(token, line_names, what_count, group_by_what):
 
-        lines_df = pd.read_json(json)
-        
-        grouped = lines_df.groupby('ID').min()
-        words = grouped['WordCount'].sum()
-        letters = len(lines_df['ID'].unique())
-        people = len(lines_df['Sender'].unique())
-        
-        final_groupby = [group_by_what, 'YearGroup', 'Line']
+        # The counts of the lines are fetched from the server with the token set by the line graph.
+        # The chart is left as it is if they have expired
+        bar_counts = result_store.get(token)
+        if bar_counts is None:
+            raise PreventUpdate
+        counts, totals = bar_counts
 
-        lines_df['PeopleCount'] = [1] * len(lines_df['WordCount'])
-        lines_df['LetterCount'] = [1] * len(lines_df['WordCount'])
-        
-        # Replace the above count in lines that have been created to show empty periods 
-        lines_df.loc[lines_df['ID'] == 'Not found', 'PeopleCount'] = 0
-        lines_df.loc[lines_df['ID'] == 'Not found', 'LetterCount'] = 0
-
-        if what_count == 'words':
-            y = 'WordCount'
-            lines_df = line_groupby_id(lines_df)
-        elif what_count == 'letters':
-            y = 'LetterCount'
-            lines_df = line_groupby_id(lines_df)
-        elif what_count == 'people':
-            y = 'PeopleCount'
-            lines_df = line_groupby_sender(lines_df)
-        
-        lines_df = lines_df.groupby(final_groupby).sum().reset_index()
+        y = {'words': 'WordCount', 'letters': 'LetterCount', 'people': 'PeopleCount'}[what_count]
+        lines_df = counts[(what_count, group_by_what)]
 
-        selection_info = f"Number of non-unique words: {words}, number of letters: {letters}, number of senders: {people}"
+        selection_info = f"Number of non-unique words: {totals['words']}, number of letters: {totals['letters']}, number of senders: {totals['people']}"
 
         fig = px.bar(
             data_frame=lines_df,
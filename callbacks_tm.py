@@ -1,73 +1,58 @@
+import uuid
 import dash
-from dash.dependencies import Input, Output, State
+from dash.dependencies import Input, Output, State, ClientsideFunction
 import dash_core_components as dcc
 import dash_html_components as html
 import dash_daq as daq
 from dash import no_update
 from dash.exceptions import PreventUpdate
 import pandas as pd
+from scipy import sparse
 from pandas.core.common import flatten
 import pyLDAvis
 import pyLDAvis.gensim
 
 from app import app
 import globals
+from topic_model import TopicModel
 
 tm = globals.topic_model
+job_runner = globals.job_runner
+model_registry = globals.model_registry
+model_cache = globals.model_cache
+vis_cache = globals.vis_cache
 data_parser = globals.data_parser
-df = data_parser.df
 rank_set, rank_list = data_parser.get_rank()
 rel_set, rel_list = data_parser.get_relationship()
 years_set = data_parser.get_years()
 pos_tags = data_parser.get_pos_list()
 
-# Callback for the POS tag selector
-@app.callback(
+# Callback for the POS tag selector. The options of the groups are looked up in the browser
+app.clientside_callback(
+    ClientsideFunction(namespace='categories', function_name='pos_options'),
     Output('pos_tm_sub', 'value'),
     Output('pos_tm_sub', 'options'),
     [Input('pos_tm_main', 'value')],
-    State('user-pos-store', 'data'))
-def tm_pos_options(mains, data):
-    values = []
-    options = []
-    for main in mains:
-        value = data_parser.get_pos_categories(data)[main]
-        values.extend(value)
-        options.extend(data_parser.list_to_dash_option_dict(value))
-
-    return values, options
+    State('user-pos-store', 'data'),
+    State('category-tables', 'data'))
 
 # Callback for the rank filter selector
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction(namespace='categories', function_name='rank_options'),
     Output('rank-sub', 'value'),
     Output('rank-sub', 'options'),
     Input('rank-main', 'value'),
-    State('user-rank-store', 'data'))
-def tm_rank_options(main, data):
-
-    values = []
-    options = []
-    value = list(data_parser.get_rank_categories(data)[main].keys())
-    values.extend(value)
-    options.extend(data_parser.dict_to_dash_options_with_hover(data_parser.get_rank_categories(data)[main]))
-        
-    return values, options
+    State('user-rank-store', 'data'),
+    State('category-tables', 'data'))
 
 # Callback for the relationship filter selector
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction(namespace='categories', function_name='relationship_options'),
     Output('relationship-sub', 'value'),
     Output('relationship-sub', 'options'),
     Input('relationship-main', 'value'),
-    State('user-relationship-store', 'data'))
-def tm_rel_options(main, data):
-
-    values = []
-    options = []
-    value = list(data_parser.get_rel_categories(data)[main].keys())
-    values.extend(value)
-    options.extend(data_parser.dict_to_dash_options_with_hover(data_parser.get_rel_categories(data)[main]))
-        
-    return values, options
+    State('user-relationship-store', 'data'),
+    State('category-tables', 'data'))
 
 # Callback for the slider element
 @app.callback(
@@ -84,10 +69,14 @@ def set_years(selected_years):
     Output('letter-scores', 'data'), 
     Output('letter-scores', 'columns'), 
     Input('button2', 'n_clicks'),
-    State('letter-list', 'value'), prevent_initial_call=True)
-def set_letter_topics(clicks,indices):
+    State('letter-list', 'value'),
+    State('tm-model', 'data'), prevent_initial_call=True)
+def set_letter_topics(clicks, indices, model_key):
+    model = model_registry.get(model_key) if model_key else None
+    if model is None:
+        raise PreventUpdate
     if indices:
-        letter_topics = tm.get_letter_topics(indices)
+        letter_topics = model.get_letter_topics(indices)
         cols = [{"name": i, "id": i} for i in letter_topics.columns]
 
         return letter_topics.to_dict('records'), cols
@@ -98,16 +87,117 @@ def set_letter_topics(clicks,indices):
 @app.callback(
     Output('letter-topics', 'data'),
     Output('letter-topics', 'columns'),
-    Input('topic-selector', 'value'), prevent_initial_call=True)
-def get_letters_per_topic(topic_id):
-    letters_for_topic = tm.get_topic_letters(topic_id)
+    Input('topic-selector', 'value'),
+    Input('topic-letters-all', 'on'),
+    State('tm-model', 'data'), prevent_initial_call=True)
+def get_letters_per_topic(topic_id, all_letters, model_key):
+    model = model_registry.get(model_key) if model_key else None
+    if model is None or topic_id is None:
+        raise PreventUpdate
+    letters_for_topic = model.get_topic_letters(topic_id, not all_letters)
     letters_for_topic = letters_for_topic.drop(columns=['Topic'])
     cols = [{"name": i, "id": i} for i in letters_for_topic.columns]
 
     return letters_for_topic.to_dict('records'), cols
 
 
-# Callback function for the topic model tab
+# Trains a topic model and gathers its results. Run as a job of the job runner, so the state of
+# the model is returned with the results to be stored in the model registry. If cache_key is
+# given, the model is also stored in the model cache
+def train_model(progress, cache_key, data, userstopwords, min_doc, max_prop, pos_lemmas, topics, iterations, alpha, alpha_boolean, eta, eta_boolean, userseed):
+
+    tm = TopicModel()
+
+    progress.update(stage='Preparing the letters')
+
+    # Data preprocessing for the LDA model 
+    corpus, dictionary, strings = tm.prepare_data(data, userstopwords, min_doc, max_prop, pos_lemmas)
+
+    progress.update(stage='Training the model', documents=0, total=len(corpus))
+
+    # Creates the LDA topic model
+    model = tm.train_lda(corpus, dictionary, topics, iterations, alpha, alpha_boolean, eta, eta_boolean, userseed, progress)
+
+    progress.update(stage='Finding the topics of the letters')
+
+    # Gets the top 20 words for each topic and topic list for the dropdown
+    topics_df, topic_list = tm.get_topics()
+
+    dominant_topics = tm.letter_topics()
+
+    letters_per_topic = tm.letters_per_topic(dominant_topics)
+
+    tm.get_most_representative(dominant_topics)
+
+    letter_list = tm.get_letter_list()
+
+    # The visualisation of the model is cached by the hash
+    tm.hash_model()
+
+    cols = [{"name": i, "id": i} for i in topics_df.columns]
+    cols2 = [{"name": i, "id": i} for i in letters_per_topic.columns]
+
+    corpus_size_msg = f"Corpus size after filtering: {dictionary.num_docs} letters, {dictionary.num_pos} (non-unique) words processed"
+
+    results = (corpus_size_msg, topics_df.to_dict('records'), cols, topic_list, letters_per_topic.to_dict('records'), cols2, letter_list)
+
+    if cache_key is not None:
+        progress.update(stage='Storing the model')
+        model_cache.put(cache_key, (results, tm.get_state()))
+
+    return results, tm.get_state()
+
+# Stores a trained model in the registry under the key, in place of the previous model of the
+# user. The other callbacks of the tab find it with the key. Returns False if the registry could
+# not keep the model, in which case the previous model is kept
+def register_model(key, state, previous_key):
+    model = TopicModel()
+    model.set_state(state)
+    if not model_registry.put(key, model):
+        return False
+    if previous_key:
+        model_registry.remove(previous_key)
+
+    return True
+
+# Creates the pyLDAvis visualisation of a trained model and stores it in the visualisation cache.
+# Run as a job of the job runner after the model has been trained
+def create_visualisation(progress, model):
+
+    progress.update(stage='Creating the visualisation')
+
+    # The corpus is given as its term × letter matrix and the topic distributions of the letters
+    # as a topics × letters matrix, so that pyLDAvis does not read the corpus or infer them again
+    vis_data = pyLDAvis.gensim.prepare(model.model, model.corpus.matrix.T, model.dictionary, doc_topic_dist=sparse.csc_matrix(model.theta.T), sort_topics=False)
+    html_vis = pyLDAvis.prepared_data_to_html(vis_data, template_type='general')
+
+    vis_cache.put(model.model_hash, html_vis)
+
+    return html_vis
+
+# Message of the progress of a training job
+def progress_message(status):
+    if status['state'] == 'queued':
+        return 'Waiting for other models to be trained, number {} in the queue'.format(status['position'])
+
+    progress = status['progress']
+    message = '{}...'.format(progress.get('stage', 'Starting'))
+    if 'pass_no' in progress:
+        message += ' pass {}/{}, chunk {}, {}/{} letters'.format(progress['pass_no'], progress['passes'], progress['chunk'], progress['documents'], progress['total'])
+
+    return message + ' ({:.0f} s)'.format(status['elapsed'])
+
+# Returns the status message of a failed job with the error it ended with. The error is the
+# traceback of the job, of which its last line names the exception
+def failure_message(status, message):
+    lines = (status['error'] or '').strip().splitlines()
+    if lines:
+        message += ' ({})'.format(lines[-1])
+
+    return message
+
+# Callback function for the topic model tab. Training is submitted to the job runner and the job
+# is polled with the interval until its results are ready
 @app.callback(
     Output('corpus_size_info', 'children'),
     Output('top-topics', 'data'),
@@ -115,11 +205,17 @@ def get_letters_per_topic(topic_id):
     Output('topic-selector', 'options'),
     Output('letters-per-topic', 'data'),
     Output('letters-per-topic', 'columns'),
-    Output('pyldavis-vis', 'srcDoc'),
     Output('letter-list','options'),
     Output('tm-results','hidden'),
     Output('confirm', 'displayed'),
-    Input('button', 'n_clicks'), # Only pressing the button initiates the function
+    Output('tm-job', 'data'),
+    Output('tm-interval', 'disabled'),
+    Output('tm-progress', 'children'),
+    Output('tm-cancel-button', 'disabled'),
+    Output('tm-model', 'data'),
+    Input('button', 'n_clicks'), # Pressing the button initiates the training
+    Input('tm-cancel-button', 'n_clicks'),
+    Input('tm-interval', 'n_intervals'),
     State('alpha_boolean', 'on'),
     State('eta_boolean', 'on'),
     State('num-topics', 'value'), # Parameters given by the user are saved in State
@@ -132,72 +228,153 @@ def get_letters_per_topic(topic_id):
     State('relationship-sub', 'value'), 
     State('slider-values', 'value'),
     State('stopwords-filter','value'),
+    State('pos-lemmas', 'on'),
     State('alpha','value'),
     State('eta', 'value'),
     State('userseed','value'), 
     State('filter-low','value'),
     State('filter-high','value'),
     State('user-relationship-store', 'data'),
-    State('user-rank-store', 'data'), prevent_initial_call=True)
-def model_params(clicks, alpha_boolean, eta_boolean, topics, iterations, tags, gender, rank_main, rank_sub, rel_main, rel_sub, years, userstopwords, alpha, eta, userseed, min_doc, max_prop, custom_rel,custom_rank):
+    State('user-rank-store', 'data'),
+    State('tm-job', 'data'),
+    State('tm-model', 'data'), prevent_initial_call=True)
+def model_params(clicks, cancel_clicks, intervals, alpha_boolean, eta_boolean, topics, iterations, tags, gender, rank_main, rank_sub, rel_main, rel_sub, years, userstopwords, pos_lemmas, alpha, eta, userseed, min_doc, max_prop, custom_rel, custom_rank, job_id, model_key):
 
     # Lists all triggered callbacks 
     changed_id = [p['prop_id'] for p in dash.callback_context.triggered][0]
 
-    # Only runs the model training if the button has been clicked
-    if 'button' in changed_id:
+    results = [no_update] * 7
+    # Outputs of a model the registry could not keep
+    too_large = (*results, no_update, False, None, True, 'The model is too large to be kept on the server. Please try fewer topics or letters.', True, no_update)
 
-        # Non-filtered data
-        data = df
+    # Submits the model training if the button has been clicked
+    if changed_id == 'button.n_clicks':
 
-        # Filters the data based on user's choices
+        # A model still being trained for the user is replaced by the new one
+        if job_id:
+            job_runner.forget(job_id)
 
-        # Filtering by selected POS-tags
-        data = tm.filter_by_tag(df, tags)
-        # Filtering by selected ranks
+        # Filters the data based on user's choices: selected POS-tags, ranks, relationship tags,
+        # gender and time period
         ranks = list(flatten([data_parser.get_rank_categories(custom_rank)[rank_main][sub] for sub in rank_sub]))
-        data = tm.filter_by_rank(data, ranks)
-        # Filtering by selected relationship tags
         relationships = list(flatten([data_parser.get_rel_categories(custom_rel)[rel_main][rel_sub] for rel_sub in rel_sub]))
-        data = tm.filter_by_rel(data, relationships)
-        # Filtering by gender
-        if gender != 'A':
-            data = tm.filter_by_sex(data, gender)
-        # Filtering by selected time period
-        if years[0] is not min(years_set) or years[1] is not max(years_set):
-            data = tm.filter_by_time(data, years)
+        gender = None if gender == 'A' else gender
+        data = tm.filter_data(tags, gender, ranks, relationships, years)
 
         # Gives a message to user if the dataframe is empty after filtering
         if(data.empty):
-            return no_update, no_update, no_update, no_update, no_update, no_update, no_update, no_update, True, True 
+            return (*results, True, True, None, True, '', True, no_update)
+
+        # A model trained before from the same letters with the same parameters is read from the
+        # model cache. Models trained without a seed are random, so they are not cached
+        cache_key = None
+        if userseed is not None:
+            parameters = {
+                'stopwords': sorted(userstopwords),
+                'min_doc': min_doc,
+                'max_prop': max_prop,
+                'pos_lemmas': pos_lemmas,
+                'topics': topics,
+                'iterations': iterations,
+                'alpha': 'asymmetric' if alpha_boolean else alpha,
+                'eta': 'auto' if eta_boolean else eta,
+                'seed': userseed
+            }
+            cache_key = model_cache.key(data, parameters)
+            cached = model_cache.get(cache_key)
+            if cached is not None:
+                results, state = cached
+                key = uuid.uuid4().hex
+                if not register_model(key, state, model_key):
+                    return too_large
+
+                return (*results, False, False, None, True, '', True, key)
+
+        job_id = job_runner.submit(train_model, cache_key, data, userstopwords, min_doc, max_prop, pos_lemmas, topics, iterations, alpha, alpha_boolean, eta, eta_boolean, userseed)
+        if job_id is None:
+            return (*results, no_update, False, None, True, 'Too many models are being trained at the moment. Please try again later.', True, no_update)
+
+        return (*results, no_update, False, job_id, False, 'Waiting for the training to start', False, no_update)
+
+    elif 'tm-cancel-button' in changed_id:
+        if job_id:
+            job_runner.cancel(job_id)
+
+        return (*results, no_update, False, no_update, False, 'Cancelling the training', True, no_update)
+
+    elif 'tm-interval' in changed_id:
+        status = job_runner.status(job_id) if job_id else None
+        if status is None:
+            return (*results, no_update, False, None, True, '', True, no_update)
+        if status['state'] in ('queued', 'running'):
+            return (*results, no_update, False, no_update, False, progress_message(status), no_update, no_update)
+
+        job_runner.forget(job_id)
+
+        # The trained model is stored in the registry under the id of the job
+        if status['state'] == 'done':
+            results, state = status['result']
+            if not register_model(job_id, state, model_key):
+                return too_large
+
+            return (*results, False, False, None, True, '', True, job_id)
+
+        if status['state'] == 'failed':
+            return (*results, no_update, False, None, True, failure_message(status, 'Training the model failed. Please try other parameters.'), True, no_update)
+
+        return (*results, no_update, False, None, True, 'The training was cancelled.', True, no_update)
 
-        # Data preprocessing for the LDA model 
-        corpus, dictionary, docs, strings = tm.prepare_data(data, userstopwords, min_doc, max_prop)
-   
-        # Creates the LDA topic model
-        model = tm.train_lda(corpus, dictionary, topics, iterations, alpha, alpha_boolean, eta, eta_boolean, userseed)
+    else:
+        return (*results, True, False, no_update, no_update, no_update, no_update, no_update)
 
-        # Gets the top 20 words for each topic and topic list for the dropdown
-        topics_df, topic_list = tm.get_topics()
 
-        dominant_topics = tm.letter_topics()
+# Callback function for the visualisation of the trained model. The visualisation is created in a
+# job of its own when the model of the user changes, so the other results are shown before it is
+# ready, and it is read from the visualisation cache if the same model has been visualised before
+@app.callback(
+    Output('pyldavis-vis', 'srcDoc'),
+    Output('tm-vis-job', 'data'),
+    Output('tm-vis-interval', 'disabled'),
+    Output('tm-vis-progress', 'children'),
+    Input('tm-model', 'data'),
+    Input('tm-visualise', 'on'),
+    Input('tm-vis-interval', 'n_intervals'),
+    State('tm-vis-job', 'data'), prevent_initial_call=True)
+def visualise_model(model_key, visualise, intervals, job_id):
 
-        letters_per_topic = tm.letters_per_topic(dominant_topics)
+    changed_id = [p['prop_id'] for p in dash.callback_context.triggered][0]
 
-        tm.get_most_representative(dominant_topics)
+    if 'tm-vis-interval' in changed_id:
+        status = job_runner.status(job_id) if job_id else None
+        if status is None:
+            return no_update, None, True, ''
+        if status['state'] in ('queued', 'running'):
+            return no_update, no_update, False, progress_message(status)
 
-        letter_list = tm.get_letter_list()
+        job_runner.forget(job_id)
+        if status['state'] == 'done':
+            return status['result'], None, True, ''
+        if status['state'] == 'failed':
+            return '', None, True, failure_message(status, 'Creating the visualisation failed.')
 
-        cols = [{"name": i, "id": i} for i in topics_df.columns]
-        cols2 = [{"name": i, "id": i} for i in letters_per_topic.columns]
+        return '', None, True, ''
 
-        # Creates the pyLDAvis visualisation of the LDA model
-        vis_data = pyLDAvis.gensim.prepare(model, corpus, dictionary, sort_topics=False)
-        html_vis = pyLDAvis.prepared_data_to_html(vis_data, template_type='general')
+    # The visualisation of the previous model is not needed anymore
+    if job_id:
+        job_runner.forget(job_id)
 
-        corpus_size_msg = f"Corpus size after filtering: {dictionary.num_docs} letters, {dictionary.num_pos} (non-unique) words processed"
-        
-        return corpus_size_msg, topics_df.to_dict('records'), cols, topic_list, letters_per_topic.to_dict('records'), cols2, html_vis, letter_list, False, False
+    model = model_registry.get(model_key) if model_key else None
+    if model is None:
+        return '', None, True, ''
+    if not visualise:
+        return '', None, True, 'The visualisation is turned off.'
 
-    else:
-        return no_update, no_update, no_update, no_update, no_update, no_update, no_update, no_update, True, False          
+    html_vis = vis_cache.get(model.model_hash)
+    if html_vis is not None:
+        return html_vis, None, True, ''
+
+    job_id = job_runner.submit(create_visualisation, model)
+    if job_id is None:
+        return '', None, True, 'Too many models are being trained at the moment, so the visualisation was not created.'
+
+    return '', job_id, False, 'Waiting for the visualisation to start'
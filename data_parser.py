@@ -1,30 +1,143 @@
 from bs4 import BeautifulSoup
+from lxml import etree
 import pandas as pd
 import glob
+import hashlib
+import json
+import numpy as np
+from scipy import sparse
+from bitmap_index import BitmapIndex
+import os
+import time
+import fcntl
+import contextlib
+import multiprocessing
 import plotly.express as px
 import string
+import nltk
+from nltk.tokenize import RegexpTokenizer
+from nltk.stem.wordnet import WordNetLemmatizer
 from pos_categories import pos_categories, pos_labels, pos_dittos
 from attribute_categories import rank_categories, relationship_categories, relationship_labels
 
+# Name of the xml:id attribute in lxml
+XML_ID = '{http://www.w3.org/XML/1998/namespace}id'
+
+# Parser instance used by the worker processes of the parallel ingestion
+_worker_parser = None
+
+def _init_worker(tei_parser):
+    global _worker_parser
+    _worker_parser = DataParser.__new__(DataParser)
+    _worker_parser.tei_parser = tei_parser
+
+# Reads a single letter in a worker process and returns its id, words and POS-tags with the stage timings
+def _read_letter_worker(path):
+    timings = {'read': 0.0, 'parse': 0.0}
+    id, words, pos = _worker_parser.read_letter(path, timings)
+    return id, words, pos, timings
+
+# Writes a file under another name in the same directory with write(f) and returns that name.
+# os.replace moves it into place, so processes reading or memory-mapping the file keep the old one
+def write_temp(path, write):
+    temp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temp_path, 'wb') as f:
+        write(f)
+    return temp_path
+
+# Returns the SHA-1 hash of the contents of a file
+def file_hash(path):
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
 class DataParser():
-    df = None
-    db_person = pd.read_csv('TCEECE/metadata/database-person.txt', sep='\t', encoding='iso-8859-1')
+    letters = None
+    timings = None
+    _tokens = None
+    _df = None
+    path_to_person = 'TCEECE/metadata/database-person.txt'
+    path_to_letter_db = 'TCEECE/metadata/database-letter.txt'
+    db_person = pd.read_csv(path_to_person, sep='\t', encoding='iso-8859-1')
     db_person = db_person.set_index('PersonCode')
-    path_to_csv = 'TCEECE/data.csv'
-
-    def __init__(self):
-        try:
-            self.df = pd.read_csv(self.path_to_csv, index_col=False)
-        except:
-            self.db_person = pd.read_csv('TCEECE/metadata/database-person.txt', sep='\t', encoding='iso-8859-1')
-            self.db_person = self.db_person.set_index('PersonCode')
-            self.db_letter = pd.read_csv('TCEECE/metadata//database-letter.txt', sep='\t', encoding='iso-8859-1')
-            self.db_letter = self.db_letter.set_index('LetterID')
-
-            self.df = self.letters_to_df()
-            self.df.to_csv(self.path_to_csv, index=False)
-        # Delete rows with missing data
-        self.df = self.df.dropna(axis='index')
+    path_to_letters = 'TCEECE/tceece-letters-c7'
+    # Tokens of the letters without metadata, with the file each token came from
+    path_to_tokens = 'TCEECE/tokens.parquet'
+    # Metadata of the letters and their senders, one row per letter
+    path_to_letter_table = 'TCEECE/letters.parquet'
+    # Integer-coded token arrays and their vocabularies, opened memory-mapped
+    path_to_arrays = 'TCEECE/arrays'
+    array_names = ['word_ids', 'lower_ids', 'tag_ids', 'letter_ids', 'type_term_offsets', 'type_term_ids']
+    vocab_names = ['word_vocab', 'lower_vocab', 'tag_vocab', 'term_vocab']
+    # Sparse matrix with the number of each POS-tag (columns) in each letter (rows)
+    matrix_names = ['letter_tag_counts']
+    # Letter columns with a bitmap index over the letters. The POS-tags have one over the tokens
+    letter_index_names = ['SenderSex', 'SenderRank', 'RelCode', 'Year']
+    # WordNet parts of speech the terms are lemmatized as, and the first letters of the CLAWS tags
+    # of each. Terms of other tags are lemmatized as nouns, as WordNetLemmatizer does by default
+    lemma_pos = ['n', 'v', 'a', 'r']
+    lemma_tags = ['N', 'V', 'J', 'R']
+    # Size, modification time and hash of the letters and metadata the caches were built from
+    path_to_manifest = 'TCEECE/manifest.json'
+    # Lock file held while the caches are checked and written, so that processes starting
+    # at the same time update them one at a time
+    path_to_lock = 'TCEECE/cache.lock'
+    # Types of the columns of the corpus. Columns with repeated strings are stored as categories,
+    # which Parquet keeps dictionary-encoded on disk
+    column_types = {
+        'ID': 'category',
+        'Words': 'category',
+        'Tags': 'category',
+        'Year': 'int16',
+        'Sender': 'category',
+        'SenderRank': 'category',
+        'SenderSex': 'category',
+        'RelCode': 'category',
+        'WordCount': 'int32'
+    }
+    token_types = {
+        'File': 'category',
+        'ID': 'category',
+        'Words': 'category',
+        'Tags': 'category'
+    }
+    letter_types = {
+        'ID': 'category',
+        'Year': 'int16',
+        'Sender': 'category',
+        'SenderRank': 'category',
+        'SenderSex': 'category',
+        'RelCode': 'category',
+        'WordCount': 'int32'
+    }
+    # Number of worker processes and letters per task used when parsing the letters
+    ingest_workers = os.cpu_count()
+    ingest_chunksize = 16
+    # Parser used for the TEI files: 'stream' for lxml's iterparse or 'soup' for BeautifulSoup
+    tei_parser = 'stream'
+
+    # The corpus is held as integer arrays with one item per token: self.word_ids, self.lower_ids
+    # (lowercased word), self.tag_ids and self.letter_ids, which index self.word_vocab,
+    # self.lower_vocab, self.tag_vocab and the rows of self.letters. The terms of the lowercased
+    # word l for the topic model are the rows self.type_term_offsets[l]:self.type_term_offsets[l+1]
+    # of self.type_term_ids, which has a column of lemmas for each part of speech in lemma_pos and
+    # indexes self.term_vocab. self.tag_lemma_pos gives the column of each POS-tag.
+    # self.letters has one row per letter with its metadata. self.letter_tag_counts counts each POS-tag in each letter.
+    # self.tag_index and self.letter_index are bitmap indexes used to select tokens and letters.
+    # self.tokens and self.df are built from these when first used.
+    # If columns is given, self.df only has those columns of the corpus
+    def __init__(self, workers=None, chunksize=None, tei_parser=None, columns=None):
+        if tei_parser is not None:
+            self.tei_parser = tei_parser
+        if workers is not None:
+            self.ingest_workers = workers
+        if chunksize is not None:
+            self.ingest_chunksize = chunksize
+        self.columns = columns
+        self.load_corpus()
         self.pos_categories = pos_categories
         self.rank_categories = rank_categories
         self.pos_labels = pos_labels
@@ -32,6 +145,333 @@ class DataParser():
         self.relationship_categories = relationship_categories
         self.relationship_labels = relationship_labels
         return 
+
+    # The corpus with the metadata of the letter on the row of each token. The view is joined
+    # from self.tokens and self.letters the first time it is used
+    @property
+    def df(self):
+        if self._df is None:
+            self._df = self.corpus_view(self.columns)
+        return self._df
+
+    # Table with one row per token: the letter code, the word and the POS-tag
+    @property
+    def tokens(self):
+        if self._tokens is None:
+            self._tokens = pd.DataFrame({
+                'Letter': self.letter_ids,
+                'Words': pd.Categorical.from_codes(self.word_ids, categories=self.word_vocab),
+                'Tags': pd.Categorical.from_codes(self.tag_ids, categories=self.tag_vocab)
+            })
+        return self._tokens
+
+    # Loads the letter table and opens the token arrays after bringing the caches up to date
+    def load_corpus(self):
+        with self.cache_lock():
+            self.update_cache()
+            if not all(os.path.exists(path) for path in self.array_paths()):
+                self.write_arrays()
+
+        letters = pd.read_parquet(self.path_to_letter_table)
+        self.letters = letters.astype(self.letter_types, copy=False)
+        self.open_arrays()
+        self.build_indexes()
+        self.tag_lemma_pos = self.tag_lemma_columns()
+
+    # Holds the lock file of the caches. Another process updating them is waited for
+    @contextlib.contextmanager
+    def cache_lock(self):
+        with open(self.path_to_lock, 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def array_paths(self):
+        arrays = [os.path.join(self.path_to_arrays, name + '.npy') for name in self.array_names]
+        vocabs = [os.path.join(self.path_to_arrays, name + '.txt') for name in self.vocab_names]
+        matrices = [os.path.join(self.path_to_arrays, name + '.npz') for name in self.matrix_names]
+        return arrays + vocabs + matrices
+
+    # Opens the token arrays memory-mapped, so that processes using the same files share their pages
+    def open_arrays(self):
+        for name in self.array_names:
+            path = os.path.join(self.path_to_arrays, name + '.npy')
+            setattr(self, name, np.load(path, mmap_mode='r'))
+        for name in self.vocab_names:
+            path = os.path.join(self.path_to_arrays, name + '.txt')
+            with open(path, 'r', encoding='utf-8') as f:
+                setattr(self, name, pd.Index(f.read().split('\n')[:-1]))
+        for name in self.matrix_names:
+            path = os.path.join(self.path_to_arrays, name + '.npz')
+            setattr(self, name, sparse.load_npz(path))
+
+    # Builds the bitmap index of the POS-tags over the tokens, and of the sender and year columns over
+    # the letters. The letter columns are the same for all tokens of a letter, so they are indexed per letter
+    def build_indexes(self):
+        self.tag_index = BitmapIndex.from_codes(self.tag_ids, self.tag_vocab)
+        self.letter_index = {}
+        for name in self.letter_index_names:
+            column = self.letters[name]
+            if name == 'Year':
+                values = np.unique(column.to_numpy())
+                codes = np.searchsorted(values, column.to_numpy())
+            else:
+                values = column.cat.categories
+                codes = column.cat.codes.to_numpy()
+            self.letter_index[name] = BitmapIndex.from_codes(codes, values)
+
+    # Returns a boolean array of the letters with the given sender sex, ranks and relationships that
+    # were written within the given years (first, last). None leaves the column unfiltered
+    def select_letters(self, sex=None, ranks=None, rels=None, years=None):
+        index = self.letter_index
+        bits = index['SenderSex'].any(sex) & index['SenderRank'].any(ranks) & index['RelCode'].any(rels)
+        if years is not None:
+            bits &= index['Year'].between(years[0], years[1])
+
+        return index['Year'].mask(bits)
+
+    # Returns a boolean array of the tokens with the given POS-tags in the letters selected by
+    # select_letters. None leaves the column unfiltered
+    def select_tokens(self, tags=None, sex=None, ranks=None, rels=None, years=None):
+        letters = self.select_letters(sex, ranks, rels, years)
+        bits = self.tag_index.any(tags) & np.packbits(letters[self.letter_ids])
+
+        return self.tag_index.mask(bits)
+
+    # Writes the tokens of the Parquet cache as integer arrays with their vocabularies
+    def write_arrays(self):
+        tokens = pd.read_parquet(self.path_to_tokens, columns=['ID', 'Words', 'Tags'])
+        letters = pd.read_parquet(self.path_to_letter_table, columns=['ID'])
+
+        # Code of each token's letter is its row in the letter table. Letters that were left out of
+        # the table for missing metadata get -1 and their tokens are dropped
+        ids = tokens['ID'].cat
+        letter_codes = pd.Index(letters['ID'].astype(str)).get_indexer(ids.categories.astype(str))
+        letter_ids = letter_codes[ids.codes.to_numpy()]
+        found = letter_ids >= 0
+
+        words = tokens['Words'].values[found].remove_unused_categories()
+        tags = tokens['Tags'].values[found].remove_unused_categories()
+        # Each word type is mapped to the code of its lowercase form
+        lowered = words.categories.str.lower()
+        lower_vocab = pd.Index(lowered.unique())
+        lower_of_word = lower_vocab.get_indexer(lowered)
+
+        arrays = {
+            'word_ids': words.codes.astype('int32'),
+            'lower_ids': lower_of_word[words.codes].astype('int32'),
+            'tag_ids': tags.codes.astype('int32'),
+            'letter_ids': letter_ids[found].astype('int32')
+        }
+        vocabs = {
+            'word_vocab': words.categories,
+            'lower_vocab': lower_vocab,
+            'tag_vocab': tags.categories
+        }
+
+        type_term_offsets, type_term_ids, term_vocab = self.type_terms(lower_vocab)
+        arrays['type_term_offsets'] = type_term_offsets
+        arrays['type_term_ids'] = type_term_ids
+        vocabs['term_vocab'] = term_vocab
+
+        # Duplicate letter and tag pairs are summed when the matrix is converted to CSR
+        ones = np.ones(len(arrays['tag_ids']), dtype='int32')
+        shape = (len(letters), len(tags.categories))
+        matrices = {
+            'letter_tag_counts': sparse.coo_matrix((ones, (arrays['letter_ids'], arrays['tag_ids'])), shape=shape).tocsr()
+        }
+
+        # All files are written first and then moved into place, as other processes may have the
+        # old ones open. The manifest is written after them by update_cache, so a set left
+        # incomplete by a crash is written again on the next start
+        os.makedirs(self.path_to_arrays, exist_ok=True)
+        files = {}
+        for name, array in arrays.items():
+            path = os.path.join(self.path_to_arrays, name + '.npy')
+            files[path] = write_temp(path, lambda f: np.save(f, array))
+        for name, matrix in matrices.items():
+            path = os.path.join(self.path_to_arrays, name + '.npz')
+            files[path] = write_temp(path, lambda f: sparse.save_npz(f, matrix))
+        for name, vocab in vocabs.items():
+            path = os.path.join(self.path_to_arrays, name + '.txt')
+            files[path] = write_temp(path, lambda f: f.write(''.join(item + '\n' for item in vocab).encode('utf-8')))
+        for path, temp_path in files.items():
+            os.replace(temp_path, path)
+
+    # Splits each lowercased word into the terms used by the topic model: the word is split into
+    # words, numbers and one-letter words are dropped and the rest are lemmatized as each part of
+    # speech in lemma_pos. The words of a letter never run together, so the terms are the same as
+    # when the letter is split as a whole. Returns the offsets of the terms of each word, the term
+    # codes with a column for each part of speech and the term vocabulary. The WordNet data of
+    # NLTK has to be installed
+    def type_terms(self, lower_vocab):
+        try:
+            nltk.data.find('corpora/wordnet')
+        except LookupError:
+            raise RuntimeError("Building the corpus cache needs the NLTK WordNet data. Install it with python -c \"import nltk; nltk.download('wordnet')\"")
+        tokenizer = RegexpTokenizer(r'\w+')
+        lemmatizer = WordNetLemmatizer()
+        term_codes = {}
+        term_ids = []
+        counts = np.zeros(len(lower_vocab), dtype='int64')
+
+        for i, lower in enumerate(lower_vocab):
+            terms = [token for token in tokenizer.tokenize(lower) if not token.isnumeric()]
+            terms = [token for token in terms if len(token.strip()) > 1]
+            for term in terms:
+                lemmas = [lemmatizer.lemmatize(term, pos) for pos in self.lemma_pos]
+                term_ids.append([term_codes.setdefault(lemma, len(term_codes)) for lemma in lemmas])
+            counts[i] = len(terms)
+
+        offsets = np.zeros(len(lower_vocab) + 1, dtype='int64')
+        np.cumsum(counts, out=offsets[1:])
+        term_ids = np.array(term_ids, dtype='int32').reshape(-1, len(self.lemma_pos))
+
+        return offsets, term_ids, pd.Index(list(term_codes), dtype=object)
+
+    # Column of type_term_ids each POS-tag is lemmatized with
+    def tag_lemma_columns(self):
+        first = self.tag_vocab.str[:1]
+        columns = np.zeros(len(self.tag_vocab), dtype='int64')
+        for column, letter in enumerate(self.lemma_tags):
+            columns[first == letter] = column
+
+        return columns
+
+    # Returns the term codes of the given tokens for the topic model and the number of terms of
+    # each token. The terms are looked up from the terms of the lowercased words, lemmatized as
+    # the part of speech of their POS-tags if pos is set, and as nouns otherwise
+    def token_terms(self, tokens, pos=False):
+        lower = self.lower_ids[tokens]
+        starts = self.type_term_offsets[lower]
+        counts = self.type_term_offsets[lower + 1] - starts
+        first = np.repeat(np.cumsum(counts) - counts, counts)
+        rows = np.repeat(starts, counts) + np.arange(counts.sum()) - first
+        if pos:
+            columns = np.repeat(self.tag_lemma_pos[self.tag_ids[tokens]], counts)
+        else:
+            columns = 0
+
+        return self.type_term_ids[rows, columns], counts
+
+    # Joins the given columns of the corpus from self.tokens and self.letters. The letter columns
+    # are repeated for each token by taking the rows of self.letters with the letter codes.
+    # If rows is given, only those tokens are joined, e.g. a boolean array from select_tokens
+    def corpus_view(self, columns=None, rows=None):
+        if columns is None:
+            columns = list(self.column_types)
+        tokens = self.tokens if rows is None else self.tokens[rows]
+        letter = tokens['Letter'].to_numpy()
+
+        data = {}
+        for col in columns:
+            if col in tokens.columns:
+                data[col] = tokens[col].values
+            else:
+                data[col] = self.letters[col].values.take(letter)
+
+        return pd.DataFrame(data)
+
+    def read_metadata(self):
+        self.db_person = pd.read_csv(self.path_to_person, sep='\t', encoding='iso-8859-1')
+        self.db_person = self.db_person.set_index('PersonCode')
+        self.db_letter = pd.read_csv(self.path_to_letter_db, sep='\t', encoding='iso-8859-1')
+        self.db_letter = self.db_letter.set_index('LetterID')
+
+    def read_manifest(self):
+        try:
+            with open(self.path_to_manifest, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'letters': {}, 'metadata': {}}
+
+    def write_manifest(self, manifest):
+        data = json.dumps(manifest, indent=1, sort_keys=True).encode()
+        os.replace(write_temp(self.path_to_manifest, lambda f: f.write(data)), self.path_to_manifest)
+
+    # Compares the letter files to the manifest. Returns the new manifest entries of the letters
+    # and the names of the letters that are new or whose contents have changed. Files are only
+    # hashed again if their size or modification time differ from the manifest
+    def scan_letters(self, manifest, files):
+        letters = {}
+        changed = []
+
+        for path in files:
+            name = os.path.basename(path)
+            stat = os.stat(path)
+            entry = manifest['letters'].get(name)
+            if entry is None or entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime_ns:
+                digest = file_hash(path)
+                if entry is None or entry['hash'] != digest:
+                    changed.append(name)
+                entry = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'hash': digest}
+            letters[name] = entry
+
+        return letters, changed
+
+    # Brings the caches up to date with the letters and the metadata. Only new and changed letters
+    # are parsed and spliced into the stored tokens, and deleted letters are dropped from them.
+    # If only the metadata has changed, the stored tokens are joined again without parsing.
+    # Called with cache_lock held
+    def update_cache(self):
+        manifest = self.read_manifest()
+        if not os.path.exists(self.path_to_tokens):
+            # Without stored tokens every letter has to be parsed
+            manifest['letters'] = {}
+
+        files = self.get_letter_files()
+        letters, changed = self.scan_letters(manifest, files)
+        deleted = [name for name in manifest['letters'] if name not in letters]
+        metadata = {
+            'person': file_hash(self.path_to_person),
+            'letter': file_hash(self.path_to_letter_db)
+        }
+        new_manifest = {'letters': letters, 'metadata': metadata}
+
+        if not changed and not deleted and metadata == manifest['metadata'] and os.path.exists(self.path_to_letter_table):
+            if letters != manifest['letters']:
+                # Files have been touched without changing their contents
+                self.write_manifest(new_manifest)
+            return
+
+        self.timings = {'read': 0.0, 'parse': 0.0, 'join': 0.0}
+        if changed or deleted:
+            tokens = self.update_tokens(files, changed, deleted)
+            ids = tokens['ID'].unique()
+        else:
+            # Only the metadata has changed, so the letter table is made again from the stored ids
+            ids = pd.read_parquet(self.path_to_tokens, columns=['ID'])['ID'].unique()
+
+        self.read_metadata()
+        letters = self.letter_table(list(ids))
+        os.replace(write_temp(self.path_to_letter_table, lambda f: letters.to_parquet(f, index=False)), self.path_to_letter_table)
+        self.write_arrays()
+
+        # The manifest is written last, so an interrupted update is redone on the next start
+        self.write_manifest(new_manifest)
+
+    # Returns the stored tokens with the given letters parsed again and the deleted ones removed.
+    # The tokens are kept in the order of the letter files
+    def update_tokens(self, files, changed, deleted):
+        li = []
+        if os.path.exists(self.path_to_tokens):
+            stored = pd.read_parquet(self.path_to_tokens)
+            li.append(stored[~stored['File'].isin(changed + deleted)])
+        if changed:
+            changed_files = [path for path in files if os.path.basename(path) in changed]
+            li.append(self.letters_to_tokens(changed_files))
+
+        tokens = pd.concat(li, axis=0, ignore_index=True)
+        # The File column becomes ordered by the file list, so that a stable sort restores the order
+        order = pd.CategoricalDtype([os.path.basename(path) for path in files], ordered=True)
+        tokens['File'] = tokens['File'].astype(str).astype(order)
+        tokens = tokens.sort_values('File', kind='mergesort', ignore_index=True)
+        tokens = tokens.astype(self.token_types)
+        os.replace(write_temp(self.path_to_tokens, lambda f: tokens.to_parquet(f, index=False)), self.path_to_tokens)
+
+        return tokens
         
     # Transforms xml-file into a BeautifulSoup-object
     def read_tei(self, tei_file):
@@ -40,24 +480,72 @@ class DataParser():
             return soup
         raise RuntimeError('Cannot generate a soup from the input')
 
-    # Creates a Pandas dataframe from a letter specified by the path-argument 
-    # with letted id, words and corresponding POS-tags as the columns 
-    def parse_letter(self, path):
+    # Returns the id of the letter and the word_TAG items of its p-elements using BeautifulSoup
+    def read_items_soup(self, tei_file):
         lst = []
-        pos = []
-        words = []
-        
+
         # Creates a BeautifulSoup-object
-        soup = self.read_tei(path)
-        
-        # Locates the letter text by using the p-tags and extracts it into a list 
-        text = list(soup.find_all('p'))
-        
-        # Splits the text into single items (word+POS-tag) and adds them to a list
-        for item in text:
+        soup = self.read_tei(tei_file)
+
+        # Locates the letter text by using the p-tags and splits it into single items (word+POS-tag)
+        for item in soup.find_all('p'):
             lst += item.text.split()
-        
-        # Splits the items into POS-tags and words and adds them to separate lists
+
+        # Extracts the id of the letter from the TEI-tag
+        return soup.tei.attrs['xml:id'], lst
+
+    # Returns the id of the letter and the word_TAG items of its p-elements by streaming
+    # the file with lxml. Elements are freed as soon as they have been read
+    def read_items_stream(self, tei_file):
+        id = None
+        lst = []
+        # Number of p-elements open. The inline elements of a p-element are kept until it has
+        # been read, as its text includes theirs
+        depth = 0
+
+        for event, element in etree.iterparse(tei_file, events=('start', 'end'), huge_tree=True):
+            tag = etree.QName(element).localname.lower()
+            if event == 'start':
+                # The attributes of the TEI-tag are available when it is opened
+                if tag == 'tei' and id is None:
+                    id = element.get(XML_ID)
+                elif tag == 'p':
+                    depth += 1
+                continue
+            if tag == 'p':
+                depth -= 1
+                lst += ''.join(element.itertext()).split()
+            if depth > 0:
+                continue
+            # Frees the element and the siblings that have already been read. The root has no
+            # parent, though comments and processing instructions before it are its siblings
+            element.clear(keep_tail=True)
+            parent = element.getparent()
+            if parent is None:
+                continue
+            while element.getprevious() is not None:
+                del parent[0]
+
+        if id is None:
+            raise ValueError('No letter id in {}'.format(tei_file))
+
+        return id, lst
+
+    # Returns the id of the letter and its word_TAG items with the parser set in self.tei_parser.
+    # The streaming parser falls back to BeautifulSoup for files that are not well-formed XML
+    def read_items(self, tei_file):
+        if self.tei_parser == 'stream':
+            try:
+                return self.read_items_stream(tei_file)
+            except (etree.XMLSyntaxError, ValueError):
+                pass
+        return self.read_items_soup(tei_file)
+
+    # Splits the word_TAG items into words and POS-tags, leaving out punctuation
+    def split_items(self, lst):
+        pos = []
+        words = []
+
         for item in lst:
             part = item.partition("_")
             if part[2] == '' or  part[2][0] in string.punctuation:
@@ -65,147 +553,102 @@ class DataParser():
             pos.append(part[2])
             words.append(part[0])
 
-        # Extracts the id of the letter from the TEI-tag
-        id = soup.tei.attrs['xml:id']
-        sender = self.db_letter.loc[id, 'Sender']
-        
-        # Combines the lists into a dict. The id is repeated for each word 
-        data = {'ID': [id] * len(pos),
-                'Words':words, 
-                'Tags':pos,
-                'Year': [self.db_letter.loc[id, 'Year']] * len(pos),
-                'Sender': [self.db_letter.loc[id, 'Sender']] * len(pos), 
-                'SenderRank': [self.db_letter.loc[id, 'SenderRank']] * len(pos),
-                'SenderSex': [self.db_person.loc[sender, 'Sex']] *len(pos),
-                'RelCode': [self.db_letter.loc[id, 'RelCode']] * len(pos),
-                'WordCount': [self.db_letter.loc[id, 'WordCount']] * len(pos)
-                }
-        
-        # Creates a Pandas Dataframe from the dict
-        df = pd.DataFrame(data) 
-        
-        return df
+        return words, pos
 
-    def letters_to_df(self):
-        # Path of the folder where the letters are located (change path to correct location when using this)
-        path = 'TCEECE/tceece-letters-c7' 
+    # Reads a letter specified by the path-argument and returns its id, words and POS-tags.
+    # If a timings dict is given, the time spent reading and parsing is added to it
+    def read_letter(self, path, timings=None):
+        start = time.perf_counter()
+        id, lst = self.read_items(path)
+        read_done = time.perf_counter()
 
-        # Uses glob-library to create a list of all the .txt-files in the folder
-        all_files = glob.glob(path + "/*.txt")
+        # Splits the items into POS-tags and words
+        words, pos = self.split_items(lst)
 
-        li = []
+        if timings is not None:
+            timings['read'] += read_done - start
+            timings['parse'] += time.perf_counter() - read_done
 
-        # Creates separate dataframes from each letter and adds them to a list
-        for filename in all_files:
-            df = self.parse_letter(filename)
-            li.append(df)
+        return id, words, pos
 
-        # Combines all dataframes in the list by using the concat-method of Pandas
-        frame = pd.concat(li, axis=0, ignore_index=True)
+    # Creates a dataframe with the id and metadata of the given letters, one row per letter.
+    # The letter and person databases are joined to the ids with two merges
+    def letter_metadata_table(self, ids):
+        letters = pd.DataFrame({'ID': ids})
+        letters = letters.merge(self.db_letter[['Year', 'Sender', 'SenderRank', 'RelCode', 'WordCount']], how='left', left_on='ID', right_index=True)
+        letters = letters.merge(self.db_person[['Sex']], how='left', left_on='Sender', right_index=True)
+        letters = letters.rename(columns={'Sex': 'SenderSex'})
 
-        return frame
-
-    def get_pos_list(self):
-
-        df = self.df
-        pos_set = set(df['Tags'])
-        pos_list = [{'label':tag, 'value':tag} for tag in pos_set]
-
-        return pos_list
-
-    def get_word_list(self):
-
-        df = self.df
-        word_set = set(df['Words'].str.lower())
-        word_list = [{'label':word, 'value':word} for word in word_set]
-
-        return word_list
-
-    def get_rank(self):
-
-        df = self.df
-        rank_set = set(df['SenderRank'])
-        rank_list = [{'label':rank, 'value':rank} for rank in rank_set]
-
-        return rank_set, rank_list
+        return letters[list(self.letter_types)]
 
-    def get_relationship(self):
+    # Creates the letter table of the given letters. Letters with missing metadata are left out
+    def letter_table(self, ids):
+        start = time.perf_counter()
 
-        df = self.df
-        rel_set = set(df['RelCode'])
-        rel_list = [{'label':rel, 'value':rel} for rel in rel_set]
-
-        return rel_set, rel_list
-
-    def get_years(self):
-
-        df = self.df
-        year_set = set(df['Year'])
-
-        return year_set
-
-    def list_to_dash_option_dict(self, l):
-        
-        options = [{'label':item, 'value':item} for item in l]
-        
-        return options
-
-    def dict_to_dash_options_with_hover(self, d):
-        
-        options = [{'label':k, 'value':k, 'title':', '.join(v)} for k,v in d.items()]
-        
-        return options
-
-    def pos_options_with_hover(self, custom, main):
-
-        l = self.get_pos_categories(custom)[main]
-        options = [{'label':tag, 'value':tag, 'title':self.pos_labels[tag] + '\n' + ', '.join(self.pos_dittos[tag])} for tag in l]
-        
-        return options
-
-    def get_pos_categories(self, custom):
-
-        try:
-            all_pos_categories = dict()
-            all_pos_categories.update(self.pos_categories)
-            all_pos_categories.update(custom)
-            return all_pos_categories
-        except:
-            return self.pos_categories
-
-    def get_rel_categories(self, custom):
-
-        try:
-            all_rel_categories = dict()
-            all_rel_categories.update(self.relationship_categories)
-            all_rel_categories.update(custom)
-            return all_rel_categories
-        except:
-            return self.relationship_categories
-    
-    def get_rank_categories(self, custom):
-
-        try:
-            all_rank_categories = dict()
-            all_rank_categories.update(self.rank_categories)
-            all_rank_categories.update(custom)
-            return all_rank_categories
-        except:
-            return self.rank_categories
-
-    def include_ditto_tags_to_pos_list(self, pos_list):
-
-        final_list = []
-        for tag in pos_list:
-            final_list.extend(self.pos_dittos[tag])
+        letters = self.letter_metadata_table(ids)
+        # Delete rows with missing data
+        letters = letters.dropna(axis='index').reset_index(drop=True)
+        letters = letters.astype(self.letter_types)
 
-        return final_list
+        if self.timings is not None:
+            self.timings['join'] += time.perf_counter() - start
 
-    def get_name(self, ids):
+        return letters
 
-        person = self.db_person
-        senders = ids.to_frame()
-        tmp = person[['FirstName','LastName']]
-        names = senders.join(tmp, on='Sender').reset_index(drop=True)
+    # Lists the letter files in a fixed order, so that the row order of the data is reproducible
+    def get_letter_files(self):
+        # Uses glob-library to create a list of all the .txt-files in the folder
+        return sorted(glob.glob(self.path_to_letters + "/*.txt"))
+
+    # Parses the letters into a dataframe of tokens. With more than one worker the letters are
+    # distributed over a process pool; the rows are in the same order as with one worker.
+    # The time spent reading and parsing is added to self.timings
+    def letters_to_tokens(self, files=None, workers=None, chunksize=None):
+        if files is None:
+            files = self.get_letter_files()
+        if workers is None:
+            workers = self.ingest_workers or 1
+        workers = min(workers, len(files))
+        if chunksize is None:
+            chunksize = self.ingest_chunksize
+        if self.timings is None:
+            self.timings = {'read': 0.0, 'parse': 0.0, 'join': 0.0}
+
+        ids = []
+        lengths = []
+        words = []
+        tags = []
+
+        # The worker processes are forked so that they do not re-import the app
+        if workers > 1 and 'fork' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('fork')
+            with context.Pool(workers, initializer=_init_worker, initargs=(self.tei_parser,)) as pool:
+                # imap returns the results in the order of the files
+                for id, letter_words, letter_tags, timings in pool.imap(_read_letter_worker, files, chunksize):
+                    ids.append(id)
+                    lengths.append(len(letter_tags))
+                    words += letter_words
+                    tags += letter_tags
+                    for stage, seconds in timings.items():
+                        self.timings[stage] += seconds
+        else:
+            for filename in files:
+                id, letter_words, letter_tags = self.read_letter(filename, self.timings)
+                ids.append(id)
+                lengths.append(len(letter_tags))
+                words += letter_words
+                tags += letter_tags
+
+        # The tokens of all letters are collected into one dataframe, repeating the file name
+        # and id of each letter for its tokens
+        join_start = time.perf_counter()
+        names = [os.path.basename(path) for path in files]
+        frame = pd.DataFrame({
+            'File': pd.Categorical(np.repeat(np.array(names, dtype=object), lengths)),
+            'ID': pd.Categorical(np.repeat(np.array(ids, dtype=object), lengths)),
+            'Words': pd.Categorical(words),
+            'Tags': pd.Categorical(tags)
+        })
+        self.timings['join'] += time.perf_counter() - join_start
 
-        return names
+        return frame
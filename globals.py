@@ -1,9 +1,31 @@
 from data_parser import DataParser
 from topic_model import TopicModel
+from result_store import ResultStore
+from job_runner import JobRunner
+from model_registry import ModelRegistry
+from model_cache import ModelCache
 
+# The instances are shared by the callbacks of all users, which Flask may run in several threads
+# at once, so the stores and caches among them lock their contents
 def initialize(): 
     global data_parser
     data_parser = DataParser() 
 
     global topic_model
-    topic_model = TopicModel() 
\ No newline at end of file
+    topic_model = TopicModel() 
+
+    global result_store
+    result_store = ResultStore()
+
+    global job_runner
+    job_runner = JobRunner()
+
+    global model_registry
+    model_registry = ModelRegistry()
+
+    global model_cache
+    model_cache = ModelCache()
+
+    # The pyLDAvis visualisations of the trained models, by the hashes of the models
+    global vis_cache
+    vis_cache = ModelCache('TCEECE/visualisations', max_bytes=256 * 1024 * 1024)
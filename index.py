@@ -15,6 +15,8 @@ from layout_404 import layout404
 import callbacks_pos, callbacks_tm, callbacks_cust
 
 app.layout = html.Div([
+    # Categories for the dropdowns, which are updated in the browser
+    dcc.Store(id='category-tables', data=globals.data_parser.category_tables()),
     dcc.Store(id='user-pos-store', storage_type='local'),
     dcc.Store(id='user-relationship-store', storage_type='local'),
     dcc.Store(id='user-rank-store', storage_type='local'),
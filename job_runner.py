@@ -0,0 +1,224 @@
+import atexit
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import traceback
+import uuid
+
+
+# Raised in a job when it checks its progress after it has been cancelled
+class JobCancelled(Exception):
+    pass
+
+
+class JobProgress:
+
+    # Progress of a job in its own process. Updates are sent to the runner through the pipe,
+    # and the runner cancels the job by setting the event
+    def __init__(self, connection, cancel_event):
+        self.connection = connection
+        self.cancel_event = cancel_event
+        self.counters = {}
+        return
+
+    # Updates the counters of the job and sends them to the runner. Stops the job by raising
+    # JobCancelled if it has been cancelled
+    def update(self, **counters):
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+        self.counters.update(counters)
+        self.connection.send(('progress', dict(self.counters)))
+
+
+# Runs the function of a job in the job process and sends its result, or the error, to the runner.
+# A job stopped in the middle may leave processes of its own running, such as the pool of
+# LdaMulticore, and their queues would keep the process from exiting. They are terminated and the
+# process exits without waiting for the queues
+def run_job(function, args, connection, cancel_event):
+    progress = JobProgress(connection, cancel_event)
+    try:
+        result = function(progress, *args)
+        connection.send(('done', result))
+    except JobCancelled:
+        connection.send(('cancelled', None))
+    except Exception:
+        connection.send(('failed', traceback.format_exc()))
+    finally:
+        connection.close()
+        for child in multiprocessing.active_children():
+            child.terminate()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(0)
+
+
+class JobRunner:
+    # Number of jobs run at the same time
+    max_jobs = 2
+    # Number of jobs waiting to be run at most, further jobs are refused
+    max_queued = 4
+    # Seconds a cancelled job has to stop by itself before its process is terminated
+    cancel_timeout = 10
+    # Seconds the results of finished jobs are kept if they are not collected
+    ttl = 30 * 60
+
+    # Runs long jobs, such as training a topic model, in their own processes so that the callbacks
+    # return at once. Each job is a function that gets a JobProgress as its first argument. The jobs
+    # are forked, so they see the loaded corpus without copying it. They are not daemonic processes,
+    # because LdaMulticore starts a pool of its own
+    def __init__(self, max_jobs=None, max_queued=None):
+        if max_jobs is not None:
+            self.max_jobs = max_jobs
+        if max_queued is not None:
+            self.max_queued = max_queued
+        self.context = multiprocessing.get_context('fork')
+        self.jobs = {}
+        self.queue = []
+        self.lock = threading.Lock()
+        atexit.register(self.shutdown)
+        return
+
+    # Queues the job and starts it if there is room. Returns the id of the job, or None if the
+    # queue is full
+    def submit(self, function, *args):
+        with self.lock:
+            self.update()
+            if len(self.queue) >= self.max_queued:
+                return None
+            job_id = uuid.uuid4().hex
+            self.jobs[job_id] = {
+                'function': function,
+                'args': args,
+                'state': 'queued',
+                'progress': {},
+                'result': None,
+                'error': None,
+                'submitted': time.monotonic(),
+                'started': None,
+                'finished': None,
+                'cancelled': None
+            }
+            self.queue.append(job_id)
+            self.start_queued()
+
+        return job_id
+
+    # Returns the state of the job ('queued', 'running', 'done', 'failed' or 'cancelled'), its
+    # progress counters, the seconds it has been running and its result or error, or None if
+    # there is no such job
+    def status(self, job_id):
+        with self.lock:
+            self.update()
+            if job_id not in self.jobs:
+                return None
+            job = self.jobs[job_id]
+            started = job['started']
+            finished = job['finished'] or time.monotonic()
+
+            return {
+                'state': job['state'],
+                'progress': job['progress'],
+                'elapsed': finished - started if started is not None else 0,
+                'position': self.queue.index(job_id) + 1 if job_id in self.queue else 0,
+                'result': job['result'],
+                'error': job['error']
+            }
+
+    # Cancels the job. A queued job is dropped, a running job is asked to stop and terminated
+    # if it has not stopped within cancel_timeout
+    def cancel(self, job_id):
+        with self.lock:
+            if job_id not in self.jobs:
+                return
+            job = self.jobs[job_id]
+            if job['state'] == 'queued':
+                self.queue.remove(job_id)
+                self.finish(job, 'cancelled')
+            elif job['state'] == 'running' and job['cancelled'] is None:
+                job['cancel_event'].set()
+                job['cancelled'] = time.monotonic()
+
+    # Drops the job and its result. A running job is cancelled first
+    def forget(self, job_id):
+        self.cancel(job_id)
+        with self.lock:
+            if job_id in self.jobs and self.jobs[job_id]['state'] not in ('queued', 'running'):
+                del self.jobs[job_id]
+
+    # Terminates the running jobs, when the server stops
+    def shutdown(self):
+        with self.lock:
+            for job in self.jobs.values():
+                if job['state'] == 'running':
+                    job['process'].terminate()
+                    self.finish(job, 'cancelled')
+            self.queue.clear()
+
+    # Reads the messages of the running jobs, terminates the cancelled jobs that have not stopped,
+    # drops the old finished jobs and starts queued jobs in place of the finished ones
+    def update(self):
+        now = time.monotonic()
+        for job_id, job in list(self.jobs.items()):
+            if job['state'] == 'running':
+                self.receive(job)
+            if job['state'] == 'running' and job['cancelled'] is not None and now - job['cancelled'] > self.cancel_timeout:
+                job['process'].terminate()
+                self.finish(job, 'cancelled')
+            if job['finished'] is not None and now - job['finished'] > self.ttl:
+                del self.jobs[job_id]
+        self.start_queued()
+
+    # Reads the messages the job has sent. If the process has ended without sending its result,
+    # the job has failed
+    def receive(self, job):
+        connection = job['connection']
+        try:
+            while job['state'] == 'running' and connection.poll():
+                message, value = connection.recv()
+                if message == 'progress':
+                    job['progress'] = value
+                elif message == 'done':
+                    job['result'] = value
+                    self.finish(job, 'done')
+                elif message == 'failed':
+                    job['error'] = value
+                    self.finish(job, 'failed')
+                else:
+                    self.finish(job, 'cancelled')
+        except EOFError:
+            self.finish(job, 'failed')
+            job['error'] = 'The job process ended with exit code {}'.format(job['process'].exitcode)
+
+    def start_queued(self):
+        running = sum(job['state'] == 'running' for job in self.jobs.values())
+        while self.queue and running < self.max_jobs:
+            self.start(self.jobs[self.queue.pop(0)])
+            running += 1
+
+    def start(self, job):
+        receiver, sender = self.context.Pipe(duplex=False)
+        job['cancel_event'] = self.context.Event()
+        job['process'] = self.context.Process(
+            target=run_job,
+            args=(job['function'], job['args'], sender, job['cancel_event']))
+        job['process'].start()
+        # The job process has its own copy of the sending end
+        sender.close()
+        job['connection'] = receiver
+        job['state'] = 'running'
+        job['started'] = time.monotonic()
+
+    # Marks the job finished and releases its process. The process is terminated if it does not
+    # exit by itself after its last message
+    def finish(self, job, state):
+        if job['state'] == 'running':
+            job['connection'].close()
+            job['process'].join(self.cancel_timeout)
+            if job['process'].is_alive():
+                job['process'].terminate()
+                job['process'].join()
+        job['state'] = state
+        job['finished'] = time.monotonic()
+        job['function'] = job['args'] = None
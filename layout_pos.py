@@ -21,11 +21,11 @@ def line_selection(i):
                     style={'padding': '20px'},
                     children=[
                         "Custom name",
-                        dcc.Input(id=f"line_name_{i}", type="text", placeholder="Custom name for line", value=f'Line {i}'),
+                        dcc.Input(id={'type': 'line_name', 'index': i}, type="text", placeholder="Custom name for line", value=f'Line {i}'),
                         html.Br(),
                         "Sender sex",
                         dcc.Dropdown(
-                            id=f'line_sex_{i}',
+                            id={'type': 'line_sex', 'index': i},
                             options=[
                                 {'label': 'M', 'value': 'M'},
                                 {'label': 'F', 'value': 'F'}
@@ -36,13 +36,13 @@ def line_selection(i):
                         html.Br(),
                         "Sender rank",
                         dcc.Dropdown(
-                            id=f'line_senderrank_main_{i}',
+                            id={'type': 'line_senderrank_main', 'index': i},
                             options=data_parser.list_to_dash_option_dict(list(data_parser.rank_categories.keys())), 
                             value='Bipartite',
                             multi=False
                         ),
                         dcc.Dropdown(
-                            id=f'line_senderrank_sub_{i}',
+                            id={'type': 'line_senderrank_sub', 'index': i},
                             options=data_parser.dict_to_dash_options_with_hover(data_parser.rank_categories['Bipartite']), 
                             value=list(data_parser.rank_categories['Bipartite'].keys()),
                             multi=True
@@ -50,13 +50,13 @@ def line_selection(i):
                         html.Br(),
                         "Relationship",
                         dcc.Dropdown(
-                            id=f'line_relationship_main_{i}',
+                            id={'type': 'line_relationship_main', 'index': i},
                             options=data_parser.list_to_dash_option_dict(list(data_parser.relationship_categories.keys())), 
                             value='Fine-grained',
                             multi=False
                         ),
                         dcc.Dropdown(
-                            id=f'line_relationship_sub_{i}',
+                            id={'type': 'line_relationship_sub', 'index': i},
                             options=data_parser.dict_to_dash_options_with_hover(data_parser.relationship_categories['Fine-grained']), 
                             value=list(data_parser.relationship_categories['Fine-grained'].keys()),
                             multi=True
@@ -64,18 +64,17 @@ def line_selection(i):
                         html.Br(),
                         "POS-tags",
                         dcc.Dropdown(
-                            id=f'pos_groups_dropdown_{i}_main',
+                            id={'type': 'pos_groups_dropdown_main', 'index': i},
                             options=data_parser.list_to_dash_option_dict(list(data_parser.pos_categories.keys())), 
                             value=['nouns'],
                             multi=True
                         ),
                         dcc.Dropdown(
-                            id=f'pos_groups_dropdown_{i}_sub',
+                            id={'type': 'pos_groups_dropdown_sub', 'index': i},
                             options=data_parser.list_to_dash_option_dict(data_parser.pos_categories['nouns']), 
                             value=data_parser.pos_categories['nouns'],
                             multi=True
-                        ),
-                        dcc.Store(id=f'line_store_{i}', storage_type='local')
+                        )
                     ])])
 
 layout1 = html.Div([
@@ -90,7 +89,6 @@ layout1 = html.Div([
         ],
         pills=True
     ),
-    html.Div(id='dummy_div'),
     dcc.Tabs([
             dcc.Tab(
                 label='Instructions',
@@ -250,13 +248,13 @@ layout1 = html.Div([
                                         labelStyle={'display': 'inline-block', 'margin-right': '10px'}
                                     ),
                                     dcc.Dropdown(
-                                        id='pos_groups_dropdown_0_main',
+                                        id={'type': 'pos_groups_dropdown_main', 'index': 0},
                                         options=data_parser.list_to_dash_option_dict(list(data_parser.pos_categories.keys())), 
                                         value=['nouns'],
                                         multi=True
                                     ),
                                     dcc.Dropdown(
-                                        id='pos_groups_dropdown_0_sub',
+                                        id={'type': 'pos_groups_dropdown_sub', 'index': 0},
                                         options=data_parser.list_to_dash_option_dict(data_parser.pos_categories['nouns']), 
                                         value=data_parser.pos_categories['nouns'],
                                         multi=True
@@ -275,7 +273,7 @@ layout1 = html.Div([
                                     ),
                                     "Sender sex",
                                     dcc.Dropdown(
-                                        id='line_sex_0',
+                                        id={'type': 'line_sex', 'index': 0},
                                         options=[
                                             {'label': 'M', 'value': 'M'},
                                             {'label': 'F', 'value': 'F'}
@@ -286,13 +284,13 @@ layout1 = html.Div([
                                     html.Br(),
                                     "Sender rank",
                                     dcc.Dropdown(
-                                        id='line_senderrank_main_0',
+                                        id={'type': 'line_senderrank_main', 'index': 0},
                                         options=data_parser.list_to_dash_option_dict(list(data_parser.rank_categories.keys())), 
                                         value='Bipartite',
                                         multi=False
                                     ),
                                     dcc.Dropdown(
-                                        id='line_senderrank_sub_0',
+                                        id={'type': 'line_senderrank_sub', 'index': 0},
                                         options=data_parser.dict_to_dash_options_with_hover(data_parser.rank_categories['Bipartite']), 
                                         value=list(data_parser.rank_categories['Bipartite'].keys()),
                                         multi=True
@@ -300,13 +298,13 @@ layout1 = html.Div([
                                     html.Br(),
                                     "Relationship",
                                     dcc.Dropdown(
-                                        id='line_relationship_main_0',
+                                        id={'type': 'line_relationship_main', 'index': 0},
                                         options=data_parser.list_to_dash_option_dict(list(data_parser.relationship_categories.keys())), 
                                         value='Fine-grained',
                                         multi=False
                                     ),
                                     dcc.Dropdown(
-                                        id='line_relationship_sub_0',
+                                        id={'type': 'line_relationship_sub', 'index': 0},
                                         options=data_parser.dict_to_dash_options_with_hover(data_parser.relationship_categories['Fine-grained']), 
                                         value=list(data_parser.relationship_categories['Fine-grained'].keys()),
                                         multi=True
@@ -339,6 +337,7 @@ layout1 = html.Div([
                     html.Div(
                         style={'padding': '20px'},
                         children=[
+                            # Token of the rows of the lines, which are kept in the result store on the server
                             html.Div(id='bar_df', style={'display': 'none'}),
                             html.Div(id='bar_names', style={'display': 'none'}),
                             dcc.Loading(
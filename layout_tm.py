@@ -264,6 +264,17 @@ layout2 = html.Div(
                                     value=['letter'],
                                     multi=True,
                                     persistence=True
+                                ),
+                                html.Br(),
+                                # Lemmatizes the words as verbs, adjectives or adverbs by their POS tags
+                                # instead of as nouns
+                                daq.BooleanSwitch(
+                                    id='pos-lemmas',
+                                    on=False,
+                                    persistence=True,
+                                    label='Lemmatize by POS tags:',
+                                    labelPosition='left',
+                                    style={'display': 'inline-block'}
                                 )
                             ]
                         ),
@@ -409,15 +420,40 @@ layout2 = html.Div(
                     children=[
                         html.Button('Train model', 
                                     id='button', 
-                                    n_clicks = 0)
+                                    n_clicks = 0),
+                        html.Button('Cancel', 
+                                    id='tm-cancel-button', 
+                                    n_clicks = 0,
+                                    disabled=True),
+                        # The pyLDAvis visualisation is created after the training, and can be
+                        # turned off for quick runs
+                        daq.BooleanSwitch(
+                            id='tm-visualise',
+                            on=True,
+                            persistence=True,
+                            label='Create the visualisation:',
+                            labelPosition='left',
+                            style={'display': 'inline-block', 'paddingLeft': '20px'}
+                        ),
+                        # Progress of the training, polled with the interval while a model is trained
+                        html.Div(id='tm-progress'),
+                        dcc.Interval(id='tm-interval',
+                                     interval=1000,
+                                     disabled=True),
+                        # Id of the training job of the user
+                        dcc.Store(id='tm-job'),
+                        # Key of the trained model of the user in the model registry
+                        dcc.Store(id='tm-model'),
+                        # The job creating the visualisation of the model, polled with its own interval
+                        dcc.Interval(id='tm-vis-interval',
+                                     interval=1000,
+                                     disabled=True),
+                        dcc.Store(id='tm-vis-job')
                     ]
                 ),
                 html.Br(),
-                # Loading-element wraps the LDA model visualisations
-                dcc.Loading(
-                    id="loading",
-                    type="circle",
-                    fullscreen = True,
+                # Div-element wraps the LDA model visualisations
+                html.Div(
                     style={'paddingTop': '15px'},
                     children=[
                             html.Div(id='corpus_size_info',
@@ -447,6 +483,13 @@ layout2 = html.Div(
                                                     style={'fontWeight':'bold'}),
                                             dcc.Dropdown(id="topic-selector", 
                                                         persistence=False),
+                                            # Ranks all letters by the weight of the topic, also those
+                                            # where it is not the dominant topic
+                                            daq.BooleanSwitch(id='topic-letters-all',
+                                                              on=False,
+                                                              label='Include letters where the topic is not dominant:',
+                                                              labelPosition='left',
+                                                              style={'display': 'inline-block', 'paddingTop': '10px'}),
                                             # Table-element that shows the most representative letters for each topic
                                             dash_table.DataTable(id="letter-topics", 
                                                                 data=[],
@@ -485,6 +528,8 @@ layout2 = html.Div(
                                         children=[
                                             html.Summary('Topic model visualisation',
                                                         style={'fontWeight':'bold'}),
+                                            # Progress of the visualisation, shown until it is ready
+                                            html.Div(id='tm-vis-progress'),
                                             # Iframe-element is used to serve the pyLDAvis visualization in html form
                                             html.Iframe(id='pyldavis-vis',
                                                         style=dict(position="absolute", width="100%", height="100%"))
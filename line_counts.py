@@ -0,0 +1,247 @@
+import hashlib
+import json
+import numpy as np
+import pandas as pd
+from lru_cache import LRUCache
+
+
+class LineCounts:
+    # Memory used at most by the cached lines
+    cache_bytes = 64 * 1024**2
+
+    def __init__(self, data_parser, cache_bytes=None):
+        self.data_parser = data_parser
+        if cache_bytes is not None:
+            self.cache_bytes = cache_bytes
+        # Letters as rows, POS-tags as columns
+        self.counts = data_parser.letter_tag_counts
+        self.letters = data_parser.letters
+        self.years = self.letters['Year'].to_numpy()
+        self.word_counts = self.letters['WordCount'].to_numpy()
+        self.attributes = ['SenderSex', 'SenderRank', 'RelCode']
+        self.first_year = int(self.years.min())
+        self.n_years = int(self.years.max()) - self.first_year + 1
+        # Cumulative tag counts by year, tag, sex, rank and relationship
+        self.cube = self.prefix_cube()
+        # Counts and rows of the lines computed before, by the key of their selection and periods
+        self.cache = LRUCache(self.cache_bytes)
+        return
+
+    # Builds the tag counts indexed by (year, tag, sex, rank, relationship) from the letter x tag matrix,
+    # summed cumulatively along the year axis. Row y holds the counts of the years before first_year + y,
+    # so the counts of any period are the difference of two rows
+    def prefix_cube(self):
+        shape = [self.n_years, self.counts.shape[1]] + [len(self.letters[a].cat.categories) for a in self.attributes]
+        counts = self.counts.tocoo()
+        rows = counts.row
+
+        index = [self.years[rows] - self.first_year, counts.col]
+        index += [self.letters[a].cat.codes.to_numpy()[rows] for a in self.attributes]
+        flat = np.ravel_multi_index(index, shape)
+        cube = np.bincount(flat, weights=counts.data, minlength=np.prod(shape)).reshape(shape)
+
+        prefix = np.zeros([self.n_years + 1] + shape[1:], dtype=np.int64)
+        np.cumsum(cube, axis=0, out=prefix[1:])
+
+        return prefix
+
+    # Returns the rows of the prefix sums at the period edges, clipped to the years of the corpus
+    def year_positions(self, edges):
+        return np.clip(np.asarray(edges) - self.first_year, 0, self.n_years)
+
+    # Counts the selected POS-tags in each period with one lookup in the cube per period edge
+    def cube_counts(self, tags, sex, ranks, rels, edges):
+        selection = [self.year_positions(edges), self.tag_columns(tags)]
+        for attribute, values in zip(self.attributes, [sex, ranks, rels]):
+            selection.append(self.attribute_codes(attribute, values))
+
+        sums = self.cube[np.ix_(*selection)].sum(axis=(1, 2, 3, 4))
+
+        return np.diff(sums)
+
+    # Splits the selected years into periods of the given length. The last period is extended
+    # to the end year. Returns the edges of the periods and their labels
+    def period_edges(self, years, periods):
+        start = years[0]
+        end = years[1]
+        full_period = end - start
+        modulo = full_period % periods
+
+        if modulo == 0:
+            end_a = end - periods
+            end_b = end_a + periods + 1
+        else:
+            end_a = end - modulo
+            end_b = end_a + modulo + 1
+
+        starts = np.arange(start, end_a, periods).tolist()
+        tuples = [(start, start+periods) for start in starts]
+        tuples.append(tuple([end_a, end_b]))
+
+        # Period i covers the years from edges[i] up to, but not including, edges[i+1]
+        edges = np.array([t[0] for t in tuples] + [tuples[-1][1]])
+        labels = ['{} - {}'.format(a, b-1) for a, b in tuples]
+
+        return edges, labels
+
+    # Returns the index of the period of each letter, or -1 if the letter is outside the periods.
+    # Period i covers the years from edges[i] up to, but not including, edges[i+1]
+    def letter_periods(self, edges):
+        periods = np.searchsorted(edges, self.years, side='right') - 1
+        periods[(self.years < edges[0]) | (self.years >= edges[-1])] = -1
+
+        return periods
+
+    # Returns a boolean array of the letters whose sender sex, rank and relationship are selected
+    def letter_mask(self, sex, ranks, rels):
+        return self.data_parser.select_letters(sex, ranks, rels)
+
+    # Returns the columns of the given POS-tags in the count matrix, leaving out tags not in the corpus
+    def tag_columns(self, tags):
+        columns = self.data_parser.tag_vocab.get_indexer(tags)
+
+        return np.unique(columns[columns >= 0])
+
+    # Returns the sorted codes of the given values of a letter column, leaving out values not in the corpus
+    def attribute_codes(self, attribute, values):
+        codes = self.letters[attribute].cat.categories.get_indexer(values)
+
+        return np.unique(codes[codes >= 0])
+
+    # Returns a hash of the selection of a line and the periods. Selections of the same tags, sex,
+    # ranks and relationships get the same key regardless of their order
+    def line_key(self, line, edges):
+        key = [sorted(set(line[name])) for name in ['tags', 'sex', 'ranks', 'rels']]
+        key.append(np.asarray(edges).tolist())
+
+        return hashlib.sha1(json.dumps(key).encode()).hexdigest()
+
+    # Returns the tag counts and the word counts of the lines with a row per line and a column per
+    # period, and the rows of the lines for the bar chart. Each line is a dict with the name, tags, sex,
+    # ranks and rels of the selection. Lines with the same selection and periods as a cached line are
+    # taken from the cache, and the others are computed together
+    def lines(self, lines, edges, labels):
+        if len(lines) == 0:
+            return self.compute_lines(lines, edges, labels)
+
+        keys = [self.line_key(line, edges) for line in lines]
+        results = {}
+        for key in keys:
+            if key not in results:
+                results[key] = self.cache.get(key)
+
+        missing = [key for key in results if results[key] is None]
+        if missing:
+            pos_counts, word_counts, rows = self.compute_lines([lines[keys.index(key)] for key in missing], edges, labels)
+            # Rows are sorted by line
+            bounds = np.searchsorted(rows['Line'].to_numpy(), np.arange(len(missing) + 1))
+            rows = rows.drop(columns='Line')
+            for i, key in enumerate(missing):
+                line_rows = rows.iloc[bounds[i]:bounds[i+1]].reset_index(drop=True)
+                results[key] = (pos_counts[i], word_counts[i], line_rows)
+                # The strings in the rows are shared with the letter table, so only the references are counted
+                size = pos_counts[i].nbytes + word_counts[i].nbytes + line_rows.memory_usage().sum()
+                self.cache.put(key, results[key], size)
+
+        pos_counts = np.array([results[key][0] for key in keys])
+        word_counts = np.array([results[key][1] for key in keys])
+        rows = pd.concat([results[key][2].assign(Line=line['name']) for key, line in zip(keys, lines)], ignore_index=True)
+
+        return pos_counts, word_counts, rows
+
+    # Computes the lines in one pass. Returns the tag counts and the word counts with a row per line and
+    # a column per period, and the rows of the lines with the position of their line in lines.
+    # The tag counts come from the cube; the word counts need the letters that have any of the tags,
+    # which a sum over tags in the cube would count more than once
+    def compute_lines(self, lines, edges, labels):
+        n_periods = len(edges) - 1
+        periods = self.letter_periods(edges)
+
+        # Tags (rows) and letters (columns) selected by each line
+        selectors = np.zeros((self.counts.shape[1], len(lines)))
+        masks = np.zeros((len(lines), len(self.letters)), dtype=bool)
+        for i, line in enumerate(lines):
+            selectors[self.tag_columns(line['tags']), i] = 1
+            masks[i] = self.letter_mask(line['sex'], line['ranks'], line['rels'])
+
+        # Letters x lines counts of the selected tags. A letter belongs to a line if it has any of them
+        tag_counts = self.counts @ selectors
+        found = masks & (periods >= 0) & (tag_counts.T > 0)
+
+        line_index, letter_index = np.nonzero(found)
+        bins = line_index * n_periods + periods[letter_index]
+        word_counts = np.bincount(bins, weights=self.word_counts[letter_index], minlength=len(lines) * n_periods)
+        pos_counts = np.array([
+            self.cube_counts(line['tags'], line['sex'], line['ranks'], line['rels'], edges) for line in lines
+        ]).reshape(len(lines), n_periods)
+
+        rows = self.line_rows(lines, found, selectors, periods, labels)
+
+        return pos_counts, word_counts.reshape(len(lines), n_periods), rows
+
+    # Creates the rows of the lines for the bar chart: one row for each selected POS-tag in each letter
+    # of a line. Periods without letters get a row with zero counts, so the graph shows all periods
+    def line_rows(self, lines, found, selectors, periods, labels):
+        counts = self.counts.tocoo()
+        # Lines x matrix entries that belong to each line, in the order of the lines
+        member = found[:, counts.row] & (selectors[counts.col].T > 0)
+        line_index, entry = np.nonzero(member)
+        rows = counts.row[entry]
+
+        df = pd.DataFrame({
+            'YearGroup': np.asarray(labels, dtype=object)[periods[rows]],
+            'ID': self.letters['ID'].to_numpy()[rows].astype(object),
+            'Sender': self.letters['Sender'].to_numpy()[rows].astype(object),
+            'SenderSex': self.letters['SenderSex'].to_numpy()[rows].astype(object),
+            'SenderRank': self.letters['SenderRank'].to_numpy()[rows].astype(object),
+            'RelCode': self.letters['RelCode'].to_numpy()[rows].astype(object),
+            'Tags': self.data_parser.tag_vocab.to_numpy()[counts.col[entry]],
+            'WordCount': self.word_counts[rows],
+            'PosCount': counts.data[entry],
+            'Line': line_index
+        })
+
+        # Periods of each line without rows, filled with mock rows
+        n_periods = len(labels)
+        present = np.bincount(line_index * n_periods + periods[rows], minlength=len(lines) * n_periods)
+        missing_line, missing_period = np.divmod(np.flatnonzero(present == 0), n_periods)
+        mock = pd.DataFrame({col: 'Not found' for col in df.columns}, index=range(len(missing_line)))
+        mock['YearGroup'] = np.asarray(labels, dtype=object)[missing_period]
+        mock['WordCount'] = 0
+        mock['PosCount'] = 0
+        mock['Line'] = missing_line
+
+        # Rows of each line are sorted by period and letter, and followed by its mock rows
+        df = pd.concat([df, mock], ignore_index=True)
+        is_mock = np.arange(len(df)) >= len(rows)
+        row_periods = np.concatenate([periods[rows], missing_period])
+        order = np.lexsort((np.arange(len(df)), row_periods, is_mock, np.concatenate([line_index, missing_line])))
+
+        return df.iloc[order].reset_index(drop=True)
+
+    # Counts the words, letters and senders of the lines for the bar chart, by the period, the line and
+    # each sender attribute. Returns the counts keyed by ('words', 'letters' or 'people', attribute) and
+    # the numbers of words, letters and senders in the selection. A letter's words are counted once per
+    # line, and a sender who has letters with different values of the attribute in a period is counted
+    # under the smallest one. Mock rows of the periods without letters count as zero
+    def bar_counts(self, rows):
+        letter_rows = rows.drop_duplicates(['ID', 'Line', 'YearGroup'])
+        found = letter_rows['ID'] != 'Not found'
+        letter_rows = letter_rows.assign(LetterCount=found.astype(int))
+        sender_rows = rows.groupby(['Sender', 'Line', 'YearGroup'], sort=False)[self.attributes].min().reset_index()
+        sender_rows['PeopleCount'] = (sender_rows['Sender'] != 'Not found').astype(int)
+
+        counts = {}
+        for attribute in self.attributes:
+            group = [attribute, 'YearGroup', 'Line']
+            counts[('words', attribute)] = letter_rows.groupby(group)['WordCount'].sum().reset_index()
+            counts[('letters', attribute)] = letter_rows.groupby(group)['LetterCount'].sum().reset_index()
+            counts[('people', attribute)] = sender_rows.groupby(group)['PeopleCount'].sum().reset_index()
+
+        totals = {
+            'words': rows.drop_duplicates('ID')['WordCount'].sum(),
+            'letters': rows['ID'].nunique(),
+            'people': rows['Sender'].nunique()
+        }
+
+        return counts, totals
@@ -0,0 +1,68 @@
+from collections import OrderedDict
+import threading
+
+
+class LRUCache:
+
+    # Keeps the most recently used values up to max_bytes in total. The size of each value is
+    # given when it is stored. hits and misses count the lookups
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        return
+
+    # Returns the value stored with the key and marks it as the most recently used, or None
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            value = self.entries[key][0]
+
+        return value
+
+    # Stores the value and drops the least recently used values until the cache fits in max_bytes.
+    # A value larger than max_bytes is not stored. Returns the dropped keys and values
+    def put(self, key, value, size):
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[1]
+            if size > self.max_bytes:
+                return [(key, value)]
+            self.entries[key] = (value, size)
+            self.bytes += size
+            dropped = []
+            while self.bytes > self.max_bytes:
+                dropped_key, (dropped_value, dropped_size) = self.entries.popitem(last=False)
+                self.bytes -= dropped_size
+                dropped.append((dropped_key, dropped_value))
+
+        return dropped
+
+    # Drops the value stored with the key, if there is one
+    def remove(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    # Returns the counters and the size of the cache
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self.entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes
+            }
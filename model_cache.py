@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import pickle
+import time
+
+import gensim
+import pandas as pd
+
+
+class ModelCache:
+    # Directory of the cached models
+    path = 'TCEECE/models'
+    # Bytes of cached models kept at most, the least recently used are deleted first
+    max_bytes = 2 * 1024 * 1024 * 1024
+    # Seconds a cached model is kept after it was last used
+    max_age = 30 * 24 * 60 * 60
+    # Changed when the results of the training change, so that older models are not used
+    version = 5
+
+    # Keeps trained topic models with their results on disk, so that a model trained again with
+    # the same letters and parameters is read instead. Each model is a file named by its key, and
+    # the modification time of the file is the time it was last used. Nothing is kept in memory,
+    # so the training jobs can store their models from their own processes
+    def __init__(self, path=None, max_bytes=None, max_age=None):
+        if path is not None:
+            self.path = path
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+        if max_age is not None:
+            self.max_age = max_age
+        os.makedirs(self.path, exist_ok=True)
+        return
+
+    # Key of a model trained from the filtered corpus with the given parameters. The rows are hashed
+    # by their values, so the key does not depend on how the corpus is stored
+    def key(self, data, parameters):
+        sha = hashlib.sha1()
+        sha.update(json.dumps([self.version, gensim.__version__, parameters], sort_keys=True).encode())
+        sha.update(pd.util.hash_pandas_object(data, index=False).to_numpy().tobytes())
+
+        return sha.hexdigest()
+
+    # Returns the model stored with the key, or None if there is none
+    def get(self, key):
+        path = self.file(key)
+        try:
+            with open(path, 'rb') as f:
+                model = pickle.load(f)
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except (OSError, pickle.UnpicklingError, EOFError):
+            # A model that cannot be read is trained again
+            self.remove(key)
+            return None
+
+        return model
+
+    # Stores the model with the key and deletes the old models. The file is written under another
+    # name first, so a model is never read half written
+    def put(self, key, model):
+        path = self.file(key)
+        temp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temp_path, 'wb') as f:
+            pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+        self.evict()
+
+    def remove(self, key):
+        self.delete(self.file(key))
+
+    # Deletes the models not used within max_age, and then the least recently used models until
+    # the rest fit in max_bytes
+    def evict(self):
+        now = time.time()
+        files = []
+        for entry in os.scandir(self.path):
+            if not entry.name.endswith('.pickle'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if now - stat.st_mtime > self.max_age:
+                self.delete(entry.path)
+            else:
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for mtime, size, path in files)
+        for mtime, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            self.delete(path)
+            total -= size
+
+    # Returns the number and bytes of the cached models
+    def stats(self):
+        sizes = [entry.stat().st_size for entry in os.scandir(self.path) if entry.name.endswith('.pickle')]
+
+        return {'entries': len(sizes), 'bytes': sum(sizes), 'max_bytes': self.max_bytes}
+
+    def file(self, key):
+        return os.path.join(self.path, '{}.pickle'.format(key))
+
+    # Deletes a file that another process may have deleted already
+    def delete(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
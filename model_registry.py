@@ -0,0 +1,109 @@
+from collections import OrderedDict
+import atexit
+import os
+import pickle
+import threading
+
+from lru_cache import LRUCache
+from topic_model import TopicModel
+
+
+class ModelRegistry:
+    # Bytes of trained models kept in memory
+    max_bytes = 512 * 1024 * 1024
+    # Directory the models dropped from memory are written to, or None to drop them altogether
+    spill_dir = None
+    # Bytes of models kept in spill_dir, the oldest are deleted first
+    max_spill_bytes = 4 * 1024 * 1024 * 1024
+
+    # Keeps the trained topic models of the users, each under its own key, so that the callbacks of
+    # a user only see the model the user trained. The least recently used models are dropped when
+    # the models take more than max_bytes, or written to spill_dir and loaded back when they are
+    # used again. The size of a model is the size of its pickled state
+    def __init__(self, max_bytes=None, spill_dir=None, max_spill_bytes=None):
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+        if spill_dir is not None:
+            self.spill_dir = spill_dir
+        if max_spill_bytes is not None:
+            self.max_spill_bytes = max_spill_bytes
+        self.models = LRUCache(self.max_bytes)
+        # Sizes of the spilled models, the least recently spilled first
+        self.spilled = OrderedDict()
+        self.lock = threading.Lock()
+        if self.spill_dir is not None:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            atexit.register(self.clear)
+        return
+
+    # Stores the model under the key. Returns False if the model could not be kept, as it is larger
+    # than max_bytes and there is no spill_dir to write it to
+    def put(self, key, model):
+        size = len(pickle.dumps(model.get_state(), protocol=pickle.HIGHEST_PROTOCOL))
+        stored = True
+        with self.lock:
+            self.remove_spilled(key)
+            for dropped_key, dropped_model in self.models.put(key, model, size):
+                if dropped_key == key and self.spill_dir is None:
+                    stored = False
+                self.spill(dropped_key, dropped_model)
+
+        return stored
+
+    # Returns the model stored under the key, loading it back from spill_dir if it has been
+    # spilled, or None if there is no such model
+    def get(self, key):
+        with self.lock:
+            model = self.models.get(key)
+            if model is None and key in self.spilled:
+                with open(self.path(key), 'rb') as f:
+                    state = f.read()
+                self.remove_spilled(key)
+                model = TopicModel()
+                model.set_state(pickle.loads(state))
+                for dropped_key, dropped_model in self.models.put(key, model, len(state)):
+                    self.spill(dropped_key, dropped_model)
+
+        return model
+
+    # Drops the model stored under the key
+    def remove(self, key):
+        with self.lock:
+            self.models.remove(key)
+            self.remove_spilled(key)
+
+    # Drops all models and deletes the spilled ones
+    def clear(self):
+        with self.lock:
+            self.models.clear()
+            for key in list(self.spilled):
+                self.remove_spilled(key)
+
+    # Returns the counters and the sizes of the models in memory and on disk
+    def stats(self):
+        with self.lock:
+            stats = self.models.stats()
+            stats['spilled'] = len(self.spilled)
+            stats['spilled_bytes'] = sum(self.spilled.values())
+
+        return stats
+
+    # The file of a spilled model. The keys are the ids of the training jobs
+    def path(self, key):
+        return os.path.join(self.spill_dir, '{}.pickle'.format(key))
+
+    # Writes a model dropped from memory to spill_dir and deletes the oldest spilled models until
+    # they fit in max_spill_bytes
+    def spill(self, key, model):
+        if self.spill_dir is None:
+            return
+        with open(self.path(key), 'wb') as f:
+            pickle.dump(model.get_state(), f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.spilled[key] = os.path.getsize(self.path(key))
+        while sum(self.spilled.values()) > self.max_spill_bytes:
+            self.remove_spilled(next(iter(self.spilled)))
+
+    def remove_spilled(self, key):
+        if key in self.spilled:
+            os.remove(self.path(key))
+            del self.spilled[key]
@@ -0,0 +1,50 @@
+from collections import OrderedDict
+import threading
+import time
+import uuid
+
+
+class ResultStore:
+    # Seconds a result is kept after it was stored or last read
+    ttl = 30 * 60
+    # Number of results kept at most, the least recently used are dropped first
+    max_entries = 100
+
+    # Keeps results on the server under random tokens, so that only the token has to be sent
+    # to the browser
+    def __init__(self, ttl=None, max_entries=None):
+        if ttl is not None:
+            self.ttl = ttl
+        if max_entries is not None:
+            self.max_entries = max_entries
+        self.results = OrderedDict()
+        self.lock = threading.Lock()
+        return
+
+    # Stores the result and returns its token
+    def put(self, result):
+        token = uuid.uuid4().hex
+        with self.lock:
+            self.evict()
+            self.results[token] = (result, time.monotonic() + self.ttl)
+            while len(self.results) > self.max_entries:
+                self.results.popitem(last=False)
+
+        return token
+
+    # Returns the result stored with the token, or None if there is none or it has expired
+    def get(self, token):
+        with self.lock:
+            self.evict()
+            if token not in self.results:
+                return None
+            result = self.results.pop(token)[0]
+            self.results[token] = (result, time.monotonic() + self.ttl)
+
+        return result
+
+    # Drops the expired results. The results are in the order of their expiry times
+    def evict(self):
+        now = time.monotonic()
+        while self.results and next(iter(self.results.values()))[1] <= now:
+            self.results.popitem(last=False)
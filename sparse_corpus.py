@@ -0,0 +1,25 @@
+from scipy import sparse
+
+
+class SparseCorpus:
+
+    # Bag-of-words corpus of gensim over the rows of a CSR letter × term matrix. Each row is made
+    # into a list of (term id, count) pairs only when it is read, as doc2bow would give it, so the
+    # corpus takes no more memory than the matrix. The matrix is used as it is, without copying
+    def __init__(self, matrix):
+        self.matrix = sparse.csr_matrix(matrix, copy=False)
+        return
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def __iter__(self):
+        indptr = self.matrix.indptr.tolist()
+        for start, end in zip(indptr[:-1], indptr[1:]):
+            yield self.row(start, end)
+
+    def __getitem__(self, letter):
+        return self.row(self.matrix.indptr[letter], self.matrix.indptr[letter + 1])
+
+    def row(self, start, end):
+        return list(zip(self.matrix.indices[start:end].tolist(), self.matrix.data[start:end].tolist()))
@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+# Runs the test in an empty project directory. data_parser reads the person metadata when it is
+# imported, so the directory has an empty one, and modules importing data_parser are imported
+# within the test
+@pytest.fixture
+def project_dir(tmp_path, monkeypatch):
+    metadata = tmp_path / 'TCEECE' / 'metadata'
+    metadata.mkdir(parents=True)
+    (metadata / 'database-person.txt').write_text('PersonCode\n', encoding='iso-8859-1')
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from bitmap_index import BitmapIndex
+
+VALUES = ['F', 'M', 'X', 'unused']
+
+
+# Codes of 21 rows, so that the last byte of the bitmaps is padded
+@pytest.fixture
+def codes():
+    return np.random.RandomState(0).randint(0, 3, size=21)
+
+
+@pytest.fixture
+def index(codes):
+    return BitmapIndex.from_codes(codes, VALUES)
+
+
+def test_any_matches_isin(index, codes):
+    names = np.array(VALUES)[codes]
+    for values in [['F'], ['M', 'X'], ['F', 'M', 'X'], ['unused'], ['missing', 'M'], []]:
+        assert np.array_equal(index.mask(index.any(values)), np.isin(names, values))
+    assert index.mask(index.any(None)).all()
+
+
+def test_between_matches_range():
+    years = np.array([1680, 1700, 1700, 1725, 1750, 1800, 1680, 1750, 1799])
+    values = np.unique(years)
+    index = BitmapIndex.from_codes(np.searchsorted(values, years), values)
+
+    for low, high in [(1680, 1800), (1700, 1750), (1701, 1749), (1726, 1749), (1800, 1900), (1600, 1679)]:
+        expected = (years >= low) & (years <= high)
+        assert np.array_equal(index.mask(index.between(low, high)), expected)
+
+
+def test_all_and_none(index, codes):
+    assert np.array_equal(index.mask(index.all()), np.ones(len(codes), dtype=bool))
+    assert np.array_equal(index.mask(index.none()), np.zeros(len(codes), dtype=bool))
+    # The padding bits of the last byte are not set
+    assert index.all()[-1] == np.packbits(np.ones(len(codes) % 8, dtype=bool))[0]
+
+
+def test_bitmaps_combine_like_masks(index, codes):
+    names = np.array(VALUES)[codes]
+    bits = index.any(['F', 'X']) & ~index.any(['X'])
+
+    assert np.array_equal(index.mask(bits), names == 'F')
@@ -0,0 +1,67 @@
+import importlib
+
+import pandas as pd
+import pytest
+
+LETTER = '''<?xml version="1.0" encoding="UTF-8"?>
+<TEI xmlns="http://www.tei-c.org/ns/1.0" xml:id="TEST001">
+<teiHeader><fileDesc><titleStmt><title>Test_NN1</title></titleStmt></fileDesc></teiHeader>
+<text><body>
+<p>a_AT <hi rend="italic">big_JJ</hi> dog_NN1 <lb/>ran_VVD</p>
+<p><sic>teh_AT</sic> cat_NN1 <hi>sat_VVD <hi>on_II</hi> the_AT</hi> mat_NN1 ._.</p>
+<closer><p>yours_PPGE <lb/><hi>John_NP1</hi></p> Smith_NP1</closer>
+</body></text>
+</TEI>
+'''
+
+
+@pytest.fixture
+def parser(project_dir):
+    data_parser = importlib.import_module('data_parser')
+    # The parser is made without loading the corpus
+    return data_parser.DataParser.__new__(data_parser.DataParser)
+
+
+def test_stream_parser_keeps_inline_markup(parser, tmp_path):
+    path = tmp_path / 'letter.xml'
+    path.write_text(LETTER, encoding='utf-8')
+
+    stream = parser.read_items_stream(str(path))
+
+    assert stream == parser.read_items_soup(str(path))
+    assert stream == ('TEST001', [
+        'a_AT', 'big_JJ', 'dog_NN1', 'ran_VVD',
+        'teh_AT', 'cat_NN1', 'sat_VVD', 'on_II', 'the_AT', 'mat_NN1', '._.',
+        'yours_PPGE', 'John_NP1'
+    ])
+
+
+def test_stream_parser_reads_letter_after_prolog_nodes(parser, tmp_path):
+    # Processing instructions and comments before the TEI-tag are siblings of the root
+    prolog = '<?xml-model href="tei_all.rng" type="application/xml"?>\n<!-- TCEECE letter -->\n'
+    letter = LETTER.replace('?>\n', '?>\n' + prolog, 1)
+    path = tmp_path / 'letter.xml'
+    path.write_text(letter, encoding='utf-8')
+
+    id, items = parser.read_items_stream(str(path))
+
+    assert id == 'TEST001'
+    assert items[:4] == ['a_AT', 'big_JJ', 'dog_NN1', 'ran_VVD']
+    assert parser.read_items(str(path)) == (id, items)
+
+
+def test_parallel_ingestion_matches_serial(parser, tmp_path):
+    files = []
+    for i in range(5):
+        path = tmp_path / 'letter{}.txt'.format(i)
+        letter = LETTER.replace('TEST001', 'TEST00{}'.format(i)).replace('dog_NN1', 'dog{}_NN1'.format(i))
+        path.write_text(letter, encoding='utf-8')
+        files.append(str(path))
+    parser.tei_parser = 'stream'
+
+    serial = parser.letters_to_tokens(files, workers=1)
+    parallel = parser.letters_to_tokens(files, workers=2, chunksize=2)
+
+    pd.testing.assert_frame_equal(parallel, serial)
+    assert list(serial['ID'].unique()) == ['TEST00{}'.format(i) for i in range(5)]
+    assert set(parser.timings) == {'read', 'parse', 'join'}
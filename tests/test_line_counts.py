@@ -0,0 +1,130 @@
+import importlib
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import sparse
+
+from line_counts import LineCounts
+
+TAGS = ['AT', 'II', 'JJ', 'NN1', 'VVD']
+LINES = [
+    {'name': 'Nouns', 'tags': ['NN1'], 'sex': ['M', 'F'], 'ranks': ['N', 'G', 'P'], 'rels': ['FN', 'FO', 'T']},
+    {'name': 'Verbs and adjectives', 'tags': ['VVD', 'JJ'], 'sex': ['F'], 'ranks': ['G', 'P'], 'rels': ['FN', 'T']},
+    {'name': 'Missing tag', 'tags': ['XX', 'AT'], 'sex': ['M'], 'ranks': ['N', 'G'], 'rels': ['FO', 'T']}
+]
+
+
+# A parser holding a small random corpus of 40 letters written from 1695 to 1740
+@pytest.fixture
+def parser(project_dir):
+    data_parser = importlib.import_module('data_parser')
+    parser = data_parser.DataParser.__new__(data_parser.DataParser)
+    rng = np.random.RandomState(1)
+    n_letters = 40
+    n_tokens = 600
+
+    parser.letters = pd.DataFrame({
+        'ID': ['L{:02}'.format(i) for i in range(n_letters)],
+        'Year': rng.randint(1695, 1741, size=n_letters),
+        'Sender': rng.choice(['S1', 'S2', 'S3', 'S4', 'S5', 'S6'], size=n_letters),
+        'SenderRank': rng.choice(['N', 'G', 'P'], size=n_letters),
+        'SenderSex': rng.choice(['M', 'F'], size=n_letters),
+        'RelCode': rng.choice(['FN', 'FO', 'T'], size=n_letters),
+        'WordCount': rng.randint(50, 500, size=n_letters)
+    }).astype(parser.letter_types)
+    parser.letter_ids = np.sort(rng.randint(0, n_letters, size=n_tokens)).astype('int32')
+    parser.tag_ids = rng.randint(0, len(TAGS), size=n_tokens).astype('int32')
+    parser.tag_vocab = pd.Index(TAGS)
+    ones = np.ones(n_tokens, dtype='int32')
+    parser.letter_tag_counts = sparse.coo_matrix((ones, (parser.letter_ids, parser.tag_ids)), shape=(n_letters, len(TAGS))).tocsr()
+    parser.build_indexes()
+
+    return parser
+
+
+# The corpus with the metadata of its letter on each token
+def token_frame(parser):
+    df = parser.letters.iloc[parser.letter_ids].reset_index(drop=True)
+    df['Tags'] = parser.tag_vocab[parser.tag_ids]
+    return df
+
+
+# Tag and word counts per period of one line, grouped from the tokens as the line graph did before
+def groupby_line(df, line, edges, labels):
+    bins = pd.IntervalIndex.from_breaks(edges, closed='left')
+    temp = df[['ID', 'Tags', 'SenderSex', 'SenderRank', 'RelCode', 'WordCount']].copy()
+    temp['YearGroup'] = pd.cut(df['Year'].astype('int'), bins=bins)
+    selection = {'Tags': line['tags'], 'SenderSex': line['sex'], 'SenderRank': line['ranks'], 'RelCode': line['rels']}
+    temp = temp[temp[list(selection)].isin(selection).all(axis=1) & temp['YearGroup'].notna()]
+    temp['YearGroup'] = temp['YearGroup'].cat.codes
+
+    grouped = temp.groupby(['YearGroup', 'ID', 'Tags', 'WordCount'], observed=True).size().to_frame(name='PosCount').reset_index()
+    pos_counts = grouped.groupby('YearGroup')['PosCount'].sum().reindex(range(len(labels)), fill_value=0)
+    word_counts = grouped.groupby(['ID', 'YearGroup'], observed=True)['WordCount'].min().groupby('YearGroup').sum()
+    word_counts = word_counts.reindex(range(len(labels)), fill_value=0)
+
+    return pos_counts.to_numpy(), word_counts.to_numpy()
+
+
+# Counts of one bar chart view grouped from the rows of the lines as the bar chart did before
+def groupby_bars(rows, what_count, group_by):
+    rows = rows.copy()
+    rows['PeopleCount'] = (rows['ID'] != 'Not found').astype(int)
+    rows['LetterCount'] = rows['PeopleCount']
+    if what_count == 'people':
+        rows = rows.groupby(['Sender', 'Line', 'YearGroup']).min().reset_index()
+    else:
+        rows = rows.groupby(['ID', 'Line', 'YearGroup']).min().reset_index()
+    y = {'words': 'WordCount', 'letters': 'LetterCount', 'people': 'PeopleCount'}[what_count]
+
+    return rows.groupby([group_by, 'YearGroup', 'Line'])[y].sum().reset_index()
+
+
+def test_period_edges_extend_the_last_period():
+    counts = LineCounts.__new__(LineCounts)
+
+    edges, labels = counts.period_edges([1700, 1733], 10)
+    assert edges.tolist() == [1700, 1710, 1720, 1730, 1734]
+    assert labels == ['1700 - 1709', '1710 - 1719', '1720 - 1729', '1730 - 1733']
+
+    edges, labels = counts.period_edges([1700, 1730], 10)
+    assert edges.tolist() == [1700, 1710, 1720, 1731]
+    assert labels == ['1700 - 1709', '1710 - 1719', '1720 - 1730']
+
+
+@pytest.mark.parametrize('years, period', [([1700, 1733], 10), ([1700, 1730], 10), ([1690, 1745], 7), ([1710, 1712], 1)])
+def test_lines_match_groupby(parser, years, period):
+    counts = LineCounts(parser)
+    df = token_frame(parser)
+    edges, labels = counts.period_edges(years, period)
+
+    pos_counts, word_counts, rows = counts.lines(LINES, edges, labels)
+
+    for i, line in enumerate(LINES):
+        expected_pos, expected_words = groupby_line(df, line, edges, labels)
+        assert np.array_equal(pos_counts[i], expected_pos)
+        assert np.array_equal(word_counts[i], expected_words)
+        line_rows = rows[rows['Line'] == line['name']]
+        assert set(line_rows['YearGroup']) == set(labels)
+        assert line_rows['PosCount'].sum() == expected_pos.sum()
+
+    # The same lines are taken from the cache
+    cached = counts.lines(LINES, edges, labels)
+    assert np.array_equal(cached[0], pos_counts) and np.array_equal(cached[1], word_counts)
+    assert cached[2].equals(rows)
+
+
+@pytest.mark.parametrize('years, period', [([1700, 1733], 10), ([1690, 1745], 7)])
+def test_bar_counts_match_groupby(parser, years, period):
+    counts = LineCounts(parser)
+    edges, labels = counts.period_edges(years, period)
+    rows = counts.lines(LINES, edges, labels)[2]
+
+    bars, totals = counts.bar_counts(rows)
+
+    for what in ['words', 'letters', 'people']:
+        for attribute in counts.attributes:
+            expected = groupby_bars(rows, what, attribute)
+            assert bars[(what, attribute)].astype(str).equals(expected.astype(str))
+    assert totals['letters'] == rows['ID'].nunique()
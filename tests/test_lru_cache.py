@@ -0,0 +1,31 @@
+import threading
+
+from lru_cache import LRUCache
+
+
+def test_cache_is_consistent_across_threads():
+    cache = LRUCache(max_bytes=50)
+    errors = []
+
+    def use(n):
+        try:
+            for i in range(2000):
+                key = (n + i) % 200
+                if cache.get(key) is None:
+                    cache.put(key, key, 1 + key % 3)
+                if i % 50 == 0:
+                    cache.remove(key)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=use, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    stats = cache.stats()
+    assert stats['bytes'] == sum(size for _, size in cache.entries.values())
+    assert stats['bytes'] <= cache.max_bytes
+    assert stats['hits'] + stats['misses'] == 8 * 2000
@@ -0,0 +1,38 @@
+import importlib
+
+import pytest
+
+
+@pytest.fixture
+def registry_class(project_dir, monkeypatch):
+    # globals is imported first, as in the app, since topic_model imports it. The models are
+    # made without a corpus
+    monkeypatch.setattr(importlib.import_module('globals'), 'data_parser', None, raising=False)
+    return importlib.import_module('model_registry').ModelRegistry
+
+
+# A model whose state is about size bytes when pickled
+def model_of_size(size):
+    TopicModel = importlib.import_module('topic_model').TopicModel
+    model = TopicModel()
+    model.set_state(dict.fromkeys(TopicModel.state, None))
+    model.model = b'x' * size
+    return model
+
+
+def test_oversized_model_is_reported_without_spill_dir(registry_class):
+    registry = registry_class(max_bytes=10000)
+    assert registry.put('small', model_of_size(100))
+
+    assert not registry.put('large', model_of_size(20000))
+    assert registry.get('large') is None
+    assert registry.get('small') is not None
+
+
+def test_oversized_model_is_spilled(registry_class, tmp_path):
+    registry = registry_class(max_bytes=10000, spill_dir=str(tmp_path))
+
+    assert registry.put('large', model_of_size(20000))
+    model = registry.get('large')
+    assert model is not None
+    assert model.model == b'x' * 20000
@@ -1,95 +1,127 @@
+import hashlib
+import logging
+import pickle
+import time
 import pandas as pd
 import numpy as np
-import nltk
-from nltk.corpus import wordnet
-from nltk.tokenize import RegexpTokenizer
-from nltk.stem.wordnet import WordNetLemmatizer
 from gensim.corpora import Dictionary
 from gensim.models.ldamulticore import LdaMulticore
+from scipy import sparse
 import globals
+from sparse_corpus import SparseCorpus
 
 class TopicModel:
 
     model = None
     corpus = None
     strings = None
-    docs = None
     dictionary = None
     topic_letters = None
+    theta = None
+    top_letters = None
+    top_letters_all = None
+    model_hash = None
 
     def __init__(self):
         self.data_parser = globals.data_parser
         return
 
-    def prepare_data(self, data, userstopwords, min_doc, max_prop):
-        
-        # Group the data by the letter id and concatenate words from each letter to one string
-        self.strings = data.groupby(['ID', 'Sender', 'SenderRank', 'SenderSex','RelCode', 'Year']).agg(lambda col: ' '.join(col))
-
-        # Create a list of strings of the letters for Gensim
-        docs = list(self.strings['Words'])
-        
-        # Split the documents into tokens.
-        tokenizer = RegexpTokenizer(r'\w+')
-        
-        for idx in range(len(docs)):
-            docs[idx] = docs[idx].lower()  # Convert to lowercase.
-            docs[idx] = tokenizer.tokenize(docs[idx])  # Split into words.
-
-        # Remove numbers, but not words that contain numbers.
-        docs = [[token for token in doc if not token.isnumeric()] for doc in docs]
-
-        # Remove words that are only one character.
-        docs = [[token for token in doc if len(token.strip()) > 1] for doc in docs]
-        
-        # Lemmatize the documents.
-        lemmatizer = WordNetLemmatizer()
-        self.docs = [[lemmatizer.lemmatize(token) for token in doc] for doc in docs]
+    # Builds the documents of the letters from the terms of the selected tokens, which were split,
+    # filtered and lemmatized when the corpus was built, leaves out the stopwords and makes the
+    # dictionary and the letter × term matrix of the bag-of-words corpus from the arrays of the
+    # terms, without making lists of the words. The index of data holds the positions of the tokens,
+    # as given by filter_data. If pos_lemmas is set, the terms are lemmatized as the part of speech
+    # of their POS-tags instead of as nouns. The time of each step is kept in self.timings
+    def prepare_data(self, data, userstopwords, min_doc, max_prop, pos_lemmas=False):
+        parser = self.data_parser
+        self.timings = {}
+        start = time.perf_counter()
+
+        # Group the tokens by the letter. The columns are categorical, so only the observed
+        # combinations are kept, one for each letter
+        groups = data.groupby(['ID', 'Sender', 'SenderRank', 'SenderSex', 'RelCode', 'Year'], observed=True)
+        self.strings = groups.size().to_frame('Tokens')
+        letters = groups.ngroup().to_numpy()
+        self.timings['group'] = time.perf_counter() - start
+        start = time.perf_counter()
+
+        # Terms of the tokens in the order of the letters, keeping the order of the tokens within each
+        # letter. The terms are looked up from the terms of the words in the corpus
+        order = np.argsort(letters, kind='stable')
+        terms, counts = parser.token_terms(data.index.to_numpy()[order], pos_lemmas)
+        term_letters = np.repeat(letters[order], counts)
+        self.timings['terms'] = time.perf_counter() - start
+        start = time.perf_counter()
 
         # Remove user stopwords
-        self.docs = [[token for token in doc if (not token in userstopwords)] for doc in self.docs]
-        
+        kept = ~parser.term_vocab.isin(userstopwords)[terms]
+        terms = terms[kept]
+        term_letters = term_letters[kept]
+        self.timings['stopwords'] = time.perf_counter() - start
+        start = time.perf_counter()
+
         # Create a dictionary representation of the documents.
-        self.dictionary = Dictionary(self.docs)
+        self.dictionary = self.make_dictionary(terms, term_letters)
 
         # Filter out words that occur in less than min_doc documents, or more than max_prop% of the documents.
         self.dictionary.filter_extremes(no_below=min_doc, no_above=max_prop)
-        
-        # Bag-of-words representation of the documents.
-        self.corpus = [self.dictionary.doc2bow(doc) for doc in self.docs]
-        
-        return self.corpus, self.dictionary, self.docs, self.strings
-
-    # Filter the data based on the POS tags 
-    def filter_by_tag(self, data, tags):
-        tag_data = data.loc[data['Tags'].isin(tags)]
-        
-        return tag_data
-
-    # Filter the data based on the gender of the author
-    def filter_by_sex(self, data, sex):
-        gender_data = data.loc[data['SenderSex'] == sex]
-        
-        return gender_data
-    
-
-    # Filter the data based on the rank of the author
-    def filter_by_rank(self, data, rank):
-        rank_data = data.loc[data['SenderRank'].isin(rank)]
-        
-        return rank_data
-    
-    # Filter the data based on the relationship between the author and the recipient
-    def filter_by_rel(self, data, rel):
-        rel_data = data.loc[data['RelCode'].isin(rel)]
-        
-        return rel_data
-    
-    # Filter the data based on the selected period
-    def filter_by_time(self, data, time):
-        period_data = data.loc[(data["Year"] >= time[0]) & (data["Year"] <= time[1])]
-
-        return period_data
+        self.timings['dictionary'] = time.perf_counter() - start
+        start = time.perf_counter()
+
+        # Letter × term matrix of the counts of the terms kept in the dictionary, read by gensim
+        # through the bag-of-words corpus over its rows
+        term_ids = np.full(len(parser.term_vocab), -1)
+        term_ids[parser.term_vocab.get_indexer(list(self.dictionary.token2id))] = list(self.dictionary.token2id.values())
+        term_ids = term_ids[terms]
+        kept = term_ids >= 0
+        matrix = sparse.csr_matrix((np.ones(kept.sum(), dtype='int32'), (term_letters[kept], term_ids[kept])),
+                                   shape=(len(self.strings), len(self.dictionary)))
+        matrix.sum_duplicates()
+        self.corpus = SparseCorpus(matrix)
+        self.timings['matrix'] = time.perf_counter() - start
+
+        return self.corpus, self.dictionary, self.strings
+
+    # Dictionary of the terms of the documents, given as the terms and the letters of the terms in
+    # the order of the letters. The terms get the ids Dictionary would give them when it is built
+    # from the documents: in the order of the letter they first appear in and then alphabetically
+    def make_dictionary(self, terms, term_letters):
+        n_terms = len(self.data_parser.term_vocab)
+        present, first = np.unique(terms, return_index=True)
+        words = self.data_parser.term_vocab.to_numpy()[present].astype(str)
+        order = np.lexsort((words, term_letters[first]))
+        present = present[order]
+
+        # Number of terms and number of different letters of each term
+        cfs = np.bincount(terms, minlength=n_terms)[present]
+        pairs = np.unique(term_letters.astype('int64') * n_terms + terms)
+        dfs = np.bincount(pairs % n_terms, minlength=n_terms)[present]
+
+        dictionary = Dictionary()
+        dictionary.token2id = dict(zip(words[order].tolist(), range(len(present))))
+        dictionary.cfs = dict(enumerate(cfs.tolist()))
+        dictionary.dfs = dict(enumerate(dfs.tolist()))
+        dictionary.num_docs = len(self.strings)
+        dictionary.num_pos = len(terms)
+        dictionary.num_nnz = len(pairs)
+
+        return dictionary
+
+    # Columns of the corpus used to build the documents
+    columns = ['ID', 'Sender', 'SenderRank', 'SenderSex', 'RelCode', 'Year', 'Words']
+
+    # Filter the data based on the POS tags, the gender and rank of the author, the relationship
+    # between the author and the recipient and the selected period (first, last). The tokens are
+    # selected from the bitmap indexes of the corpus, and None leaves a column unfiltered. The
+    # index of the data holds the positions of the tokens in the corpus
+    def filter_data(self, tags=None, sex=None, ranks=None, rels=None, years=None):
+        if sex is not None:
+            sex = [sex]
+        rows = self.data_parser.select_tokens(tags, sex, ranks, rels, years)
+        data = self.data_parser.corpus_view(self.columns, rows)
+        data.index = np.flatnonzero(rows)
+
+        return data
 
     # Filter out stopwords selected by user
     def filter_by_userstopwords(self, data, userstopwords):
@@ -98,8 +130,9 @@ class TopicModel:
         userstopwords_data = data[data['Words'].isin(userstopwords) == False]
         return userstopwords_data
 
-    # Train the LDA topic model
-    def train_lda(self, data, dictionary, n_topics, n_iter, man_alpha, alpha_boolean, man_eta, eta_boolean, userseed):
+    # Train the LDA topic model. If progress is given, the passes and chunks of the training are
+    # reported to it
+    def train_lda(self, data, dictionary, n_topics, n_iter, man_alpha, alpha_boolean, man_eta, eta_boolean, userseed, progress=None):
         
         # Set training parameters.
         num_topics = n_topics
@@ -116,19 +149,37 @@ class TopicModel:
         if eta_boolean == True:
             man_eta = 'auto'    
 
+        # LdaMulticore logs a PROGRESS record for each chunk it dispatches, with the pass, the chunk,
+        # the documents dispatched and the number of documents as arguments. A filter on its logger
+        # passes them to progress, which may also stop the training if the job has been cancelled
+        logger = logging.getLogger('gensim.models.ldamulticore')
+        level = logger.level
+        def report(record):
+            if str(record.msg).startswith('PROGRESS: pass'):
+                pass_no, chunk_no, documents, total = record.args[:4]
+                progress.update(passes=passes, pass_no=pass_no + 1, chunk=chunk_no + 1, documents=documents, total=total)
+            return record.levelno > logging.INFO
+        if progress is not None:
+            logger.addFilter(report)
+            logger.setLevel(logging.INFO)
+
         # Train LDA model.
-        self.model = LdaMulticore(
-            corpus=data,
-            id2word=dictionary,
-            chunksize=chunksize,
-            alpha=man_alpha,
-            eta=man_eta,
-            iterations=iterations,
-            num_topics=num_topics,
-            passes=passes,
-            eval_every=eval_every,
-            random_state=state
-        )
+        try:
+            self.model = LdaMulticore(
+                corpus=data,
+                id2word=dictionary,
+                chunksize=chunksize,
+                alpha=man_alpha,
+                eta=man_eta,
+                iterations=iterations,
+                num_topics=num_topics,
+                passes=passes,
+                eval_every=eval_every,
+                random_state=state
+            )
+        finally:
+            logger.removeFilter(report)
+            logger.setLevel(level)
         
         return self.model
 
@@ -146,40 +197,38 @@ class TopicModel:
         return df, topic_list
     
 
-    # Lists the topic distribution for given letters
+    # Lists the topic distribution for given letters from the rows of self.theta. Topics below the
+    # minimum probability of the model are shown as 0, as the model leaves them out
     def get_letter_topics(self, indices):
         d = {}
-        num_topics = len(self.model.print_topics())
+        minimum = max(self.model.minimum_probability, 1e-8)
         d["Letter"] = [', '.join(map(str, self.strings.index[ind])) for ind in indices]
-        
-        for n in range(num_topics):
-            d["Topic {}".format(n+1)] = [0]*len(indices)
-        
-        for i, index in enumerate(indices):
-            for ind, score in self.model[self.corpus[index]]:
-                topic = "Topic {}".format(ind+1)
-                d[topic][i] = round(float(score), 3)
+
+        scores = self.theta[indices]
+        for n in range(scores.shape[1]):
+            d["Topic {}".format(n+1)] = [round(float(score), 3) if score >= minimum else 0 for score in scores[:, n]]
 
         df = pd.DataFrame(d)
         
         return df
 
-    # Lists the main topics for each letter
+    # Infers the topic distributions of all letters in one batch into self.theta, a letter × topic
+    # matrix, and lists the main topic of each letter
     def letter_topics(self):
-        # Init output
-        topics_df = pd.DataFrame()
+        gamma, _ = self.model.inference(self.corpus)
 
-        # Get main topic in each letter
-        for i, row in enumerate(self.model[self.corpus]):
-            row = sorted(row, key=lambda x: (x[1]), reverse=True)
-            # Get the dominant topic, percentage contribution and keywords for each letter
-            for j, (topic_num, prop_topic) in enumerate(row):
-                if j == 0:  # dominant topic
-                    topics_df = topics_df.append(pd.Series([int(topic_num)+1, round(prop_topic,4)]), ignore_index=True)
-                else:
-                    break
+        # The distributions are normalized as the model does for a single letter, which adds up
+        # each row in order
+        totals = np.cumsum(gamma, axis=1, dtype=np.float64)[:, -1]
+        self.theta = gamma / totals[:, None].astype(gamma.dtype)
 
-        topics_df.columns = ['Dominant topic', 'Contribution of topic to letter']
+        # Get the dominant topic and its percentage contribution for each letter
+        dominant = self.theta.argmax(axis=1)
+        contribution = np.round(self.theta[np.arange(len(dominant)), dominant], 4)
+        topics_df = pd.DataFrame({
+            'Dominant topic': dominant + 1,
+            'Contribution of topic to letter': contribution.astype(float)
+        })
 
         # Add letter and sender id to the end of the output dataframe
         senders = self.strings.index.to_frame(index=False)
@@ -189,25 +238,37 @@ class TopicModel:
 
         return topics_df
 
-    # Lists for each topic a letter where the topic had the largest contribution
-    def get_most_representative(self, dominant_topics):
-
-        topics_sorted = pd.DataFrame()
+    # Number of representative letters listed for each topic
+    representative_letters = 40
 
-        topics_out = dominant_topics.groupby('Dominant topic')
-
-        for i, grp in topics_out:
-            topics_sorted = pd.concat([topics_sorted, grp.sort_values(['Contribution of topic to letter'], ascending=[0]).head(40)],axis=0)
+    # Finds for each topic the letters where the topic had the largest contribution, among the
+    # letters where it is the dominant topic and among all letters. The letters are taken from
+    # each column of self.theta with argpartition and only they are sorted. self.top_letters and
+    # self.top_letters_all hold the rows of the letters for each topic, padded with -1, and
+    # self.topic_letters holds the letter details for get_topic_letters
+    def get_most_representative(self, dominant_topics):
+        n = min(self.representative_letters, len(self.theta))
+        topics = np.arange(self.theta.shape[1])
 
-        # Reset Index    
-        topics_sorted.reset_index(drop=True, inplace=True)
+        # Letters where the topic is not dominant are ranked below all others and dropped
+        dominant = (dominant_topics['Dominant topic'].to_numpy() - 1)[:, None] == topics
+        self.top_letters = self.top_rows(np.where(dominant, self.theta, -1), n)
+        self.top_letters_all = self.top_rows(self.theta, n)
 
         # Format
+        topics_sorted = dominant_topics.copy()
         topics_sorted.columns = ['Topic', "Contribution of topic to letter", "Sender", "First name", "Last name", "Letter id", 'Rank', 'Gender','Relationship', "Year"]
+        self.topic_letters = topics_sorted
 
-        topics_sorted["Contribution of topic to letter"] = topics_sorted["Contribution of topic to letter"].round(decimals=3)
+    # Rows of the n largest scores of each column, largest first, with -1 in place of negative scores
+    def top_rows(self, scores, n):
+        rows = np.argpartition(-scores, n - 1, axis=0)[:n]
+        top = np.take_along_axis(scores, rows, axis=0)
+        order = np.argsort(-top, axis=0, kind='stable')
+        rows = np.take_along_axis(rows, order, axis=0)
+        rows[np.take_along_axis(top, order, axis=0) < 0] = -1
 
-        self.topic_letters = topics_sorted
+        return rows.T
 
     # Counts the number and percentage of documents for which each topic is dominant
     def letters_per_topic(self, dominant_topics):
@@ -243,8 +304,40 @@ class TopicModel:
  
         return letter_list
     
-    # Returns a dataframe of the most representative letters for the requested topic
-    def get_topic_letters(self, topic):
-        topic_df = self.topic_letters.loc[self.topic_letters['Topic'] == topic]
+    # Hashes the topics of the trained model, the topics of the letters and the documents, which is
+    # all the pyLDAvis visualisation is made of, so that the visualisation of a model trained again
+    # with the same results is found by the hash
+    def hash_model(self):
+        sha = hashlib.sha1()
+        sha.update(self.model.state.get_lambda().tobytes())
+        sha.update(self.theta.tobytes())
+        for array in (self.corpus.matrix.indptr, self.corpus.matrix.indices, self.corpus.matrix.data):
+            sha.update(array.tobytes())
+        sha.update(pickle.dumps(self.dictionary.token2id, protocol=4))
+        self.model_hash = sha.hexdigest()
+
+        return self.model_hash
+
+    # Attributes that hold the trained model and the data it was trained on
+    state = ['model', 'corpus', 'strings', 'dictionary', 'topic_letters', 'theta', 'top_letters', 'top_letters_all', 'model_hash']
+
+    # Returns the trained model and its data, so that a model trained in another process can be
+    # taken into use with set_state
+    def get_state(self):
+        return {name: getattr(self, name) for name in self.state}
+
+    def set_state(self, state):
+        for name in self.state:
+            setattr(self, name, state[name])
+
+    # Returns a dataframe of the most representative letters for the requested topic, among the
+    # letters where it is the dominant topic or, if dominant_only is not set, among all letters
+    def get_topic_letters(self, topic, dominant_only=True):
+        rows = (self.top_letters if dominant_only else self.top_letters_all)[topic - 1]
+        rows = rows[rows >= 0]
+        topic_df = self.topic_letters.iloc[rows].reset_index(drop=True)
+        topic_df['Topic'] = topic
+        contribution = pd.Series(np.round(self.theta[rows, topic - 1], 4), dtype=float)
+        topic_df["Contribution of topic to letter"] = contribution.round(decimals=3)
 
         return topic_df